@@ -1 +1,2 @@
+import bagit_create.batch
 import bagit_create.main
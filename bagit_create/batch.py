@@ -0,0 +1,187 @@
+# Batch SIP creation
+# Run many bagit-create jobs in parallel on a pool of worker processes,
+# retrying failed ones and collecting a result record for each of them
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import main
+from .pipelines import indico
+from .pipelines.base import WrongInputException
+
+DEFAULT_BATCH_WORKERS = 4
+DEFAULT_RETRIES = 2
+# Seconds to wait before retrying a failed job
+DEFAULT_RETRY_DELAY = 5
+
+# Indico instance of every source whose categories can be harvested
+INDICO_SOURCES = {
+    "indico": "https://indico.cern.ch/",
+    "ilcagenda": "https://agenda.linearcollider.org/",
+}
+
+
+def read_jobs(path):
+    """
+    Read a jobs file, containing one job per line, either as
+    `<SOURCE> <RECORD_ID>` or as a record URL.
+    Empty lines and lines starting with # are ignored.
+    """
+    jobs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = line.split()
+            if len(parts) == 1:
+                jobs.append({"url": parts[0]})
+            elif len(parts) == 2:
+                jobs.append({"source": parts[0], "recid": parts[1]})
+            else:
+                raise ValueError(f"Malformed job line: '{line}'")
+    return jobs
+
+
+def normalize_job(job):
+    """
+    Jobs can be (source, recid) couples or dictionaries of `main.process`
+    parameters (e.g. {"source": "zenodo", "recid": 42, "token": "..."})
+    """
+    if isinstance(job, dict):
+        job = dict(job)
+    else:
+        source, recid = job
+        job = {"source": source, "recid": recid}
+    job.setdefault("source", None)
+    job.setdefault("recid", None)
+    return job
+
+
+def run_job(job, options, retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY):
+    """
+    Run a single job, retrying it up to `retries` times if it fails.
+    Returns a result record with the outcome of the last attempt.
+    """
+    params = {**options, **job}
+    params.setdefault("loglevel", 2)
+
+    start = time.time()
+    attempts = 0
+    while True:
+        attempts += 1
+        result = main.process(**params)
+        if result["status"] == 0 or attempts > retries:
+            break
+        time.sleep(retry_delay)
+
+    errormsg = result.get("errormsg")
+    return {
+        "source": job["source"],
+        "recid": job["recid"],
+        "url": job.get("url"),
+        "status": result["status"],
+        # Exceptions are turned into strings, so records can be serialized
+        "errormsg": str(errormsg) if errormsg is not None else None,
+        "foldername": result.get("foldername"),
+        "attempts": attempts,
+        "duration": round(time.time() - start, 3),
+    }
+
+
+def collect_result(future, job):
+    """
+    Wait for a job running in a worker process, turning any unexpected
+    failure of the worker into a failed result record
+    """
+    try:
+        return future.result()
+    except Exception as e:
+        return {
+            "source": job["source"],
+            "recid": job["recid"],
+            "url": job.get("url"),
+            "status": 1,
+            "errormsg": str(e),
+            "foldername": None,
+            "attempts": 1,
+            "duration": None,
+        }
+
+
+def process_many(
+    jobs,
+    workers=DEFAULT_BATCH_WORKERS,
+    retries=DEFAULT_RETRIES,
+    retry_delay=DEFAULT_RETRY_DELAY,
+    **options,
+):
+    """
+    Create a SIP for every given job, running up to `workers` jobs at the
+    same time (each one in its own process, so logging and pipeline state
+    are kept separate).
+
+    Any additional keyword argument (e.g. target, loglevel, token, dry_run)
+    is passed to `main.process` for every job, unless the job overrides it.
+
+    Returns a report with a result record for each job (in the same order
+    they were given) and a summary.
+    """
+    jobs = [normalize_job(job) for job in jobs]
+    start = time.time()
+
+    if workers <= 1:
+        results = [run_job(job, options, retries, retry_delay) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(run_job, job, options, retries, retry_delay)
+                for job in jobs
+            ]
+            results = [collect_result(future, job) for future, job in zip(futures, jobs)]
+
+    successful = sum(1 for result in results if result["status"] == 0)
+    return {
+        "results": results,
+        "summary": {
+            "total": len(results),
+            "successful": successful,
+            "failed": len(results) - successful,
+            "duration": round(time.time() - start, 3),
+        },
+    }
+
+
+def harvest_indico_category(
+    category_id,
+    start=None,
+    end=None,
+    token=None,
+    source="indico",
+    **kwargs,
+):
+    """
+    Create a SIP for every event of an Indico category (optionally between the
+    `start` and `end` dates) of the instance of the given source (see
+    INDICO_SOURCES). The metadata of the events is fetched in a few paginated
+    requests to the category export API and handed to the jobs, which then
+    only download the attachments of their event.
+
+    Takes the same arguments of `process_many` and returns its report.
+    """
+    if source not in INDICO_SOURCES:
+        raise WrongInputException(f"Categories can't be harvested from {source}")
+
+    pipeline = indico.IndicoV1Pipeline(INDICO_SOURCES[source], token=token)
+    try:
+        jobs = [
+            {
+                "source": source,
+                "recid": event["id"],
+                "prefetched_metadata": {"content": event, "url": url},
+            }
+            for event, url in pipeline.get_category_events(category_id, start, end)
+        ]
+    finally:
+        pipeline.close_session()
+    return process_many(jobs, token=token, **kwargs)
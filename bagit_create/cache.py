@@ -0,0 +1,209 @@
+# Payload cache
+# Content-addressed store of downloaded payload files, shared across runs.
+# Files are indexed by their checksums, so a file already fetched for a
+# previous job (e.g. an older version of the same record) is linked into the
+# new bag instead of being downloaded again, when the upstream metadata
+# carries one of its checksums.
+
+import errno
+import fcntl
+import json
+import logging
+import os
+import re
+
+from .fileops import link_file
+
+log = logging.getLogger("bic-basic-logger")
+
+DEFAULT_CACHE_MAX_SIZE = 50 * 1024**3
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+# File keeping the total size of the cached files, at the root of the cache
+SIZE_FILENAME = "size.json"
+
+
+def parse_size(value):
+    """
+    Parse a size in bytes, optionally followed by a unit (e.g. 500M, 50G)
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", str(value), re.I)
+    if not match:
+        raise ValueError(f"Invalid size: '{value}'")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+class PayloadCache:
+    """
+    On disk cache of payload files, laid out as:
+
+        <path>/<algorithm>/<digest[:2]>/<digest>       (the file)
+        <path>/<algorithm>/<digest[:2]>/<digest>.json  (size and checksums)
+
+    The same file is hardlinked under every algorithm it was hashed with, so
+    it can be found from any of its checksums while taking space only once.
+    When the cache grows over `max_size`, the least recently used files are
+    evicted. The total size is kept up to date in `size.json` as files are
+    added, so the cache is only scanned when it actually needs evicting.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_CACHE_MAX_SIZE):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+        if not os.listdir(self.path):
+            self.update_size(total=0)
+
+    def key_path(self, alg, digest):
+        digest = digest.lower()
+        return f"{self.path}/{alg}/{digest[:2]}/{digest}"
+
+    def lookup(self, checksums, size=None):
+        """
+        Find a cached file matching the given checksums (and size, if given).
+        Returns a (path, entry) couple, where the entry has the `size` and all
+        the known `checksums` of the file, or None.
+        """
+        for alg, digest in checksums.items():
+            path = self.key_path(alg, digest)
+            entry = self.read_entry(path)
+            if entry is None or not os.path.isfile(path):
+                continue
+            if size is not None and int(size) != entry["size"]:
+                continue
+            # Every other given checksum must agree with the cached ones
+            if any(
+                entry["checksums"].get(other, value.lower()) != value.lower()
+                for other, value in checksums.items()
+            ):
+                continue
+            # Mark as recently used
+            os.utime(f"{path}.json")
+            return path, entry
+        return None
+
+    def read_entry(self, path):
+        try:
+            with open(f"{path}.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, src, checksums):
+        """
+        Add the file at src to the cache, under every given checksum
+        """
+        entry = {"size": os.path.getsize(src), "checksums": checksums}
+        source = src
+        cached = any(
+            os.path.exists(self.key_path(alg, digest))
+            for alg, digest in checksums.items()
+        )
+        for alg, digest in checksums.items():
+            path = self.key_path(alg, digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to temporary files and rename them, so concurrent jobs
+            #  never see half written entries
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                link_file(source, tmp, "hardlink")
+                os.replace(tmp, path)
+                # Other keys are hardlinks to the cached copy
+                source = path
+                with open(tmp, "w") as f:
+                    json.dump(entry, f)
+                os.replace(tmp, f"{path}.json")
+            except OSError as e:
+                log.warning(f"Unable to add {src} to the cache: {e}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                return False
+        if not cached:
+            self.update_size(entry["size"])
+        return True
+
+    def update_size(self, delta=0, total=None):
+        """
+        Add delta to the total size of the cached files (or set it to total),
+        locking the size file against the other jobs using the cache.
+        Returns the new total, or None if it's not known (e.g. for a cache
+        created before the size was tracked) until it's set.
+        """
+        with open(f"{self.path}/{SIZE_FILENAME}", "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                current = json.load(f)["size"]
+            except (ValueError, KeyError, TypeError):
+                current = None
+            if total is None:
+                if current is None:
+                    return None
+                total = current + delta
+            f.seek(0)
+            f.truncate()
+            json.dump({"size": total}, f)
+        return total
+
+    def materialize(self, path, dest):
+        """
+        Make the cached file at path available at dest
+        """
+        if os.path.exists(dest):
+            os.remove(dest)
+        mode = link_file(path, dest, "hardlink")
+        log.debug(f"Took {os.path.basename(dest)} from the cache ({mode})")
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache fits `max_size`
+        """
+        total = self.update_size()
+        if total is not None and total <= self.max_size:
+            return 0
+
+        # Group the keys by file, as the same file is linked under many keys
+        groups = {}
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.endswith(".json") or filename.endswith(".tmp"):
+                    continue
+                path = f"{dirpath}/{filename}"
+                try:
+                    stat = os.stat(path)
+                    used = os.path.getmtime(f"{path}.json")
+                except OSError:
+                    continue
+                group = groups.setdefault(
+                    (stat.st_dev, stat.st_ino),
+                    {"size": stat.st_size, "used": used, "paths": []},
+                )
+                group["used"] = max(group["used"], used)
+                group["paths"].append(path)
+
+        total = sum(group["size"] for group in groups.values())
+        if total <= self.max_size:
+            self.update_size(total=total)
+            return 0
+
+        evicted = 0
+        for group in sorted(groups.values(), key=lambda group: group["used"]):
+            if total <= self.max_size:
+                break
+            for path in group["paths"]:
+                for victim in (path, f"{path}.json"):
+                    try:
+                        os.remove(victim)
+                    except OSError as e:
+                        if e.errno != errno.ENOENT:
+                            raise
+            total -= group["size"]
+            evicted += 1
+        self.update_size(total=total)
+
+        log.info(f"Evicted {evicted} files from the cache at {self.path}")
+        return evicted
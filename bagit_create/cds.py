@@ -97,13 +97,17 @@ def getRawFilesLocs(metadata_filename):
     return files
 
 
-def downloadRemoteFile(src, dest, verify=True):
+def downloadRemoteFile(src, dest, verify=True, hasher=None, session=None):
     try:
-        r = requests.get(src, stream=True, verify=verify)
+        # Use the given (pooled) session if any
+        http = session or requests
+        r = http.get(src, stream=True, verify=verify)
         with open(dest, "wb") as f:
             for chunk in r.raw.stream(1024, decode_content=False):
                 if chunk:
                     f.write(chunk)
+                    if hasher:
+                        hasher.update(chunk)
 
         # r = requests.get(src)
         # with open(dest, "wb") as f:
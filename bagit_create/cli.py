@@ -1,10 +1,24 @@
 #!/usr/bin/env python3
 
+import json
 from typing import Text
 
 import click
 
+from .batch import (
+    DEFAULT_BATCH_WORKERS,
+    DEFAULT_RETRIES,
+    DEFAULT_RETRY_DELAY,
+    INDICO_SOURCES,
+    harvest_indico_category,
+    process_many,
+    read_jobs,
+)
+from .fileops import LINK_MODES
+from .hashing import DEFAULT_HASH_WORKERS
 from .main import process
+from .pipelines.base import DEFAULT_DOWNLOAD_WORKERS
+from .pipelines.gitlab import CLONE_MODES
 from .version import complete_version
 
 """bagit-create command line tool."""
@@ -186,6 +200,87 @@ from .version import complete_version
     default=None,
     is_flag=False,
 )
+@click.option(
+    "--download-workers",
+    help="""
+    Number of payload files to download at the same time.
+    """,
+    type=click.IntRange(min=1),
+    default=DEFAULT_DOWNLOAD_WORKERS,
+    show_default=True,
+)
+@click.option(
+    "--hash-workers",
+    help="""
+    Number of payload files to hash at the same time, when computing
+    the manifests.""",
+    type=click.IntRange(min=1),
+    default=DEFAULT_HASH_WORKERS,
+    show_default=True,
+)
+@click.option(
+    "--full-validate",
+    help="""
+    Validate the created bag re-hashing every payload file, instead of checking
+    the manifests against the checksums computed while creating it.""",
+    default=False,
+    is_flag=True,
+)
+@click.option(
+    "--staging",
+    help="""
+    Where the bag is built before being moved to the target folder.
+    'target' builds it in a hidden folder inside the target and publishes it
+    with a rename, 'tmp' builds it in /tmp and copies it over.""",
+    type=click.Choice(["target", "tmp"]),
+    default="target",
+    show_default=True,
+)
+@click.option(
+    "--link-mode",
+    help="""
+    How local source files are brought into the bag (and bags built on another
+    filesystem are published): 'copy' copies them, 'reflink' makes copy-on-write
+    clones and 'hardlink' hardlinks them (sharing them with the source!).
+    Both fall back to a copy when the filesystem doesn't support them.""",
+    type=click.Choice(LINK_MODES),
+    default="copy",
+    show_default=True,
+)
+@click.option(
+    "--resume",
+    help="""
+    Keep the bag folder and a journal of the downloaded files if the job fails,
+    and pick up from there when running again for the same record.""",
+    default=False,
+    is_flag=True,
+)
+@click.option(
+    "--cache-dir",
+    help="""
+    Keep downloaded payload files in this folder, and take them from there
+    (instead of downloading them again) when a later job needs a file with
+    the same upstream checksum.""",
+    type=click.Path(file_okay=False),
+    default=None,
+)
+@click.option(
+    "--cache-max-size",
+    help="Maximum size of the payload cache (e.g. 500M, 50G).",
+    type=Text,
+    default="50G",
+    show_default=True,
+)
+@click.option(
+    "--clone-mode",
+    help="""
+    How GitLab repositories are captured: 'full' clones them, 'shallow' clones
+    the latest commit only, 'partial' leaves out the history of files over 1MB
+    and 'bundle' saves every ref in a single git bundle file.""",
+    type=click.Choice(CLONE_MODES),
+    default="full",
+    show_default=True,
+)
 def cli(
     recid,
     source,
@@ -206,6 +301,15 @@ def cli(
     collection,
     embargo,
     comment,
+    download_workers,
+    hash_workers,
+    full_validate,
+    staging,
+    link_mode,
+    resume,
+    cache_dir,
+    cache_max_size,
+    clone_mode,
 ):
     # Select the desired log level (default is 2, warning)
     if very_verbose:
@@ -218,27 +322,244 @@ def cli(
     # This "wrapper" method allows the main one to be called
     #  from python, ignoring the click CLI interface
     result = process(
-        recid,
-        source,
-        loglevel,
-        target,
-        source_path,
-        author,
-        source_base_path,
-        dry_run,
-        alternate_uri,
-        bibdoc,
-        bd_ssh_host,
-        cert,
-        token,
-        skipssl,
-        url,
-        collection,
-        embargo,
-        comment,
+        recid=recid,
+        source=source,
+        loglevel=loglevel,
+        target=target,
+        source_path=source_path,
+        author=author,
+        source_base_path=source_base_path,
+        dry_run=dry_run,
+        bibdoc=bibdoc,
+        bd_ssh_host=bd_ssh_host,
+        cert=cert,
+        token=token,
+        skipssl=skipssl,
+        url=url,
+        collection=collection,
+        embargo=embargo,
+        comment=comment,
+        download_workers=download_workers,
+        hash_workers=hash_workers,
+        full_validate=full_validate,
+        staging=staging,
+        link_mode=link_mode,
+        resume=resume,
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+        clone_mode=clone_mode,
     )
     print(f"Job result: {result}")
 
 
+@click.command()
+@click.version_option(complete_version)
+@click.argument(
+    "jobs_file", type=click.Path(exists=True, dir_okay=False), required=False
+)
+@click.option(
+    "--indico-category",
+    help="""
+    Instead of reading a jobs file, create a SIP for every event of this
+    Indico category (and its subcategories).""",
+    type=Text,
+    default=None,
+)
+@click.option(
+    "--indico-source",
+    help="Indico instance of the harvested category.",
+    type=click.Choice(list(INDICO_SOURCES), case_sensitive=False),
+    default="indico",
+    show_default=True,
+)
+@click.option(
+    "--indico-from",
+    help="Only harvest Indico events starting from this date (e.g. 2023-01-01).",
+    type=Text,
+    default=None,
+)
+@click.option(
+    "--indico-to",
+    help="Only harvest Indico events up to this date (e.g. 2023-12-31).",
+    type=Text,
+    default=None,
+)
+@click.option(
+    "--workers",
+    "-w",
+    help="Number of SIPs to create at the same time.",
+    type=click.IntRange(min=1),
+    default=DEFAULT_BATCH_WORKERS,
+    show_default=True,
+)
+@click.option(
+    "--retries",
+    help="How many times a failed job is tried again.",
+    type=click.IntRange(min=0),
+    default=DEFAULT_RETRIES,
+    show_default=True,
+)
+@click.option(
+    "--retry-delay",
+    help="Seconds to wait before trying again a failed job.",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_RETRY_DELAY,
+    show_default=True,
+)
+@click.option(
+    "--target",
+    "-t",
+    help="""
+    Output folder for the generated SIPs. By default uses the same folder
+    the tool is being executed from.""",
+    type=Text,
+    default=None,
+)
+@click.option(
+    "--token",
+    "-tk",
+    help="Additional authentication token, used for every job (see bic --help).",
+    type=Text,
+    default=None,
+)
+@click.option(
+    "-d",
+    "--dry-run",
+    help="Skip downloads and create `light` bags, without any payload.",
+    default=False,
+    is_flag=True,
+)
+@click.option(
+    "--download-workers",
+    help="Number of payload files to download at the same time, for each job.",
+    type=click.IntRange(min=1),
+    default=DEFAULT_DOWNLOAD_WORKERS,
+    show_default=True,
+)
+@click.option(
+    "--hash-workers",
+    help="Number of payload files to hash at the same time, for each job.",
+    type=click.IntRange(min=1),
+    default=DEFAULT_HASH_WORKERS,
+    show_default=True,
+)
+@click.option(
+    "--resume",
+    help="Keep failed jobs' folders, so retries and later runs can resume them.",
+    default=False,
+    is_flag=True,
+)
+@click.option(
+    "--cache-dir",
+    help="Payload cache folder, shared by all the jobs (see bic --help).",
+    type=click.Path(file_okay=False),
+    default=None,
+)
+@click.option(
+    "--cache-max-size",
+    help="Maximum size of the payload cache (e.g. 500M, 50G).",
+    type=Text,
+    default="50G",
+    show_default=True,
+)
+@click.option(
+    "--report",
+    help="Save the result of every job and the summary to this JSON file.",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+)
+@click.option(
+    "--verbose",
+    "-v",
+    help="Enable basic logging (verbose, 'info' level).",
+    default=False,
+    is_flag=True,
+)
+@click.option(
+    "--very-verbose",
+    "-vv",
+    help="Enable verbose logging (very verbose, 'debug' level).",
+    default=False,
+    is_flag=True,
+)
+def batch(
+    jobs_file,
+    indico_category,
+    indico_source,
+    indico_from,
+    indico_to,
+    workers,
+    retries,
+    retry_delay,
+    target,
+    token,
+    dry_run,
+    download_workers,
+    hash_workers,
+    resume,
+    cache_dir,
+    cache_max_size,
+    report,
+    verbose,
+    very_verbose,
+):
+    """
+    Create a SIP for every job listed in JOBS_FILE, one per line, either as
+    `<SOURCE> <RECORD_ID>` or as a record URL, or for every event of an
+    Indico category (see --indico-category).
+    """
+    if very_verbose:
+        loglevel = 0
+    elif verbose:
+        loglevel = 1
+    else:
+        loglevel = 2
+
+    options = dict(
+        workers=workers,
+        retries=retries,
+        retry_delay=retry_delay,
+        loglevel=loglevel,
+        target=target,
+        token=token,
+        dry_run=dry_run,
+        download_workers=download_workers,
+        hash_workers=hash_workers,
+        resume=resume,
+        cache_dir=cache_dir,
+        cache_max_size=cache_max_size,
+    )
+
+    if indico_category:
+        result = harvest_indico_category(
+            indico_category,
+            start=indico_from,
+            end=indico_to,
+            source=indico_source,
+            **options,
+        )
+    elif jobs_file:
+        result = process_many(read_jobs(jobs_file), **options)
+    else:
+        raise click.UsageError("Give a JOBS_FILE or an --indico-category.")
+
+    for job in result["results"]:
+        name = job["url"] or f"{job['source']} {job['recid']}"
+        if job["status"] == 0:
+            print(f"[OK] {name} -> {job['foldername']}")
+        else:
+            print(f"[FAILED] {name} ({job['attempts']} attempts): {job['errormsg']}")
+
+    summary = result["summary"]
+    print(
+        f"Done. {summary['successful']} successful, {summary['failed']} failed"
+        f" in {summary['duration']}s"
+    )
+
+    if report:
+        with open(report, "w") as f:
+            json.dump(result, f, indent=4)
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,199 @@
+# File entries
+# Compact representation of the "File" objects built by the pipelines (one for
+# every payload and metadata file), serialized to the sip.json `contentFiles`
+# format only when written. Keys are written in the order they were set, as
+# with the plain dictionaries used before.
+
+import json
+import os
+
+
+def serialize(value):
+    """
+    JSON friendly version of a value stored in a record
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    return value
+
+
+def dump_json(content, f):
+    """
+    Write content to the open file f as indented JSON (with Unicode data as-is),
+    one chunk at a time as it gets encoded, so the whole text (e.g. of a
+    sip.json with hundreds of thousands of File objects) is never held in
+    memory. The output is the same as json.dumps(content, indent=4,
+    ensure_ascii=False, default=serialize).
+    """
+    encoder = json.JSONEncoder(indent=4, ensure_ascii=False, default=serialize)
+    f.writelines(encoder.iterencode(content))
+
+
+class Record:
+    """
+    Slotted record with dictionary-like access, so records can be used where
+    plain dictionaries were (e.g. file["origin"]["url"], "checksum" in file).
+
+    Known keys are stored in slots (unset slots are missing keys), any other
+    key in a dictionary allocated only when needed. The keys are listed (and
+    serialized) in the order they were first set.
+    """
+
+    __slots__ = ("extra", "order")
+    fields = ()
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        extra = getattr(self, "extra", None)
+        if extra is None or key not in extra:
+            raise KeyError(key)
+        return extra[key]
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            order = getattr(self, "order", None)
+            if order is None:
+                order = self.order = []
+            order.append(key)
+        if key in self.fields:
+            setattr(self, key, value)
+            return
+        extra = getattr(self, "extra", None)
+        if extra is None:
+            extra = self.extra = {}
+        extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.fields:
+            delattr(self, key)
+        else:
+            del self.extra[key]
+        self.order.remove(key)
+
+    def __contains__(self, key):
+        if key in self.fields:
+            return hasattr(self, key)
+        extra = getattr(self, "extra", None)
+        return extra is not None and key in extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def keys(self):
+        return list(getattr(self, "order", None) or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, other=(), **kwargs):
+        for key, value in dict(other, **kwargs).items():
+            self[key] = value
+
+    def to_dict(self):
+        """
+        Plain dictionary (recursively), as written in sip.json
+        """
+        return {key: serialize(value) for key, value in self.items()}
+
+
+class FileOrigin(Record):
+    """
+    Where a file comes from (e.g. its URL or its path in the local source)
+    """
+
+    fields = ("filename", "path", "url", "sourcePath", "size", "id", "title")
+    __slots__ = fields
+
+
+class FileEntry(Record):
+    """
+    A "File" object: a payload or metadata file of the SIP.
+    `origin` is a FileOrigin.
+    """
+
+    fields = (
+        "origin",
+        "bagpath",
+        "size",
+        "checksum",
+        "metadata",
+        "downloaded",
+        "date",
+        "creator",
+        "localpath",
+        "rawstat",
+    )
+    __slots__ = fields
+
+    def __init__(self, origin=None, **kwargs):
+        if origin is not None:
+            if not isinstance(origin, FileOrigin):
+                origin = FileOrigin(**origin)
+            # Always the first key, as in the plain dictionaries
+            kwargs = {"origin": origin, **kwargs}
+        super().__init__(**kwargs)
+
+
+class BagpathResolver:
+    """
+    Keeps track of the bagpaths taken by the files of a bag, to give every
+    new file a unique one. When a bagpath is already taken, the file name is
+    prefixed with the given id (e.g. data/content/{id}-filename1.jpg).
+    Lookups are done in a set, so resolving the paths of n files takes
+    linear time.
+    """
+
+    def __init__(self, files=()):
+        self.taken = {file["bagpath"] for file in files if "bagpath" in file}
+
+    def resolve(self, bagpath, id):
+        """
+        Returns a free bagpath for the file, and marks it as taken
+        """
+        while bagpath in self.taken:
+            folder, filename = os.path.split(bagpath)
+            bagpath = os.path.join(folder, f"{id}-{filename}")
+        self.taken.add(bagpath)
+        return bagpath
@@ -0,0 +1,121 @@
+# File operations
+# Put files in a bag without copying their contents when the filesystem
+# allows it (hardlinks, copy-on-write clones, in-kernel copies), falling back
+# to a streaming copy only when needed
+
+import errno
+import os
+import shutil
+
+# How files are brought into the bag
+#  copy: in-kernel copy (copy_file_range) where available, streaming copy otherwise
+#  reflink: copy-on-write clone (e.g. Btrfs, XFS), falling back to copy
+#  hardlink: hardlink (same filesystem only), falling back to reflink and copy
+LINK_MODES = ["copy", "reflink", "hardlink"]
+
+# FICLONE ioctl request code (linux/fs.h)
+FICLONE = 0x40049409
+
+# Errors meaning that an operation is not supported for the given files,
+#  so the next method should be tried
+UNSUPPORTED = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EMLINK,
+    errno.EBADF,
+}
+
+
+def reflink(src, dest):
+    """
+    Copy-on-write clone of src to dest.
+    Raises OSError if the filesystem doesn't support it.
+    """
+    import fcntl
+
+    with open(src, "rb") as source, open(dest, "wb") as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dest)
+            raise
+
+
+def copy_file_range(src, dest):
+    """
+    Copy src to dest inside the kernel (on some filesystems, e.g. NFS or
+    XFS, without even moving the data).
+    Raises OSError if the system doesn't support it for the given files.
+    """
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+
+    with open(src, "rb") as source, open(dest, "wb") as target:
+        size = os.fstat(source.fileno()).st_size
+        copied = 0
+        try:
+            while copied < size:
+                n = os.copy_file_range(source.fileno(), target.fileno(), size - copied)
+                if n == 0:
+                    # Some filesystems report success without copying
+                    raise OSError(errno.EINVAL, "copy_file_range copied nothing")
+                copied += n
+        except OSError:
+            target.close()
+            os.remove(dest)
+            raise
+
+
+def link_file(src, dest, mode="copy"):
+    """
+    Make the file at src available at dest, with the given link mode
+    (see LINK_MODES). Copies keep the permission bits of the source.
+    Returns the method actually used.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError(f"Unknown link mode '{mode}'")
+
+    attempts = []
+    if mode == "hardlink":
+        attempts.append(("hardlink", os.link))
+    if mode in ("hardlink", "reflink"):
+        attempts.append(("reflink", reflink))
+    attempts.append(("copy_file_range", copy_file_range))
+
+    method = "copy"
+    for name, attempt in attempts:
+        try:
+            attempt(src, dest)
+            method = name
+            break
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+    else:
+        shutil.copyfile(src, dest)
+
+    if method != "hardlink":
+        shutil.copymode(src, dest)
+    return method
+
+
+def link_tree(src, dest, mode="copy"):
+    """
+    Recreate the src folder at dest, bringing every file over with link_file.
+    Returns how many files were handled with each method.
+    """
+    methods = {}
+    for dirpath, dirnames, filenames in os.walk(src):
+        target = os.path.join(dest, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for filename in filenames:
+            method = link_file(
+                os.path.join(dirpath, filename), os.path.join(target, filename), mode
+            )
+            methods[method] = methods.get(method, 0) + 1
+    return methods
@@ -0,0 +1,149 @@
+# Checksum helpers
+# Compute several digests of the same data at once, so that every payload file
+# is read a single time no matter how many manifests are requested
+
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from zlib import adler32
+
+# Payload files are read in blocks of this size
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# How many files are hashed at the same time by default
+DEFAULT_HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# Files smaller than this are hashed in batches, to keep the pool busy with
+#  a few large tasks instead of many tiny ones
+SMALL_FILE_SIZE = 1024 * 1024
+SMALL_FILES_BATCH_SIZE = 32 * 1024 * 1024
+SMALL_FILES_BATCH_COUNT = 256
+
+# e.g. "md5:be99bc4762f1add866d8c08abb2e0657"
+CHECKSUM_PATTERN = re.compile(r"([A-z0-9]*):([A-z0-9]*)")
+
+
+class Adler32:
+    """
+    hashlib-like wrapper around zlib.adler32
+    """
+
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data):
+        self.value = adler32(data, self.value)
+
+    def hexdigest(self):
+        return hex(self.value)[2:10].zfill(8).lower()
+
+
+class MultiHasher:
+    """
+    Feed the same stream of bytes to every requested algorithm
+    (md5, sha1, sha256, adler32 or anything else supported by hashlib)
+    """
+
+    def __init__(self, algorithms):
+        self.hashes = {}
+        for alg in algorithms:
+            if alg not in self.hashes:
+                self.hashes[alg] = Adler32() if alg == "adler32" else hashlib.new(alg)
+        # Number of bytes seen so far
+        self.size = 0
+
+    def update(self, chunk):
+        for h in self.hashes.values():
+            h.update(chunk)
+        self.size += len(chunk)
+
+    def hexdigests(self):
+        return {alg: h.hexdigest() for alg, h in self.hashes.items()}
+
+
+def feed_file(path, hasher, chunk_size=CHUNK_SIZE):
+    """
+    Read the given file once, in chunks, feeding it to the hasher
+    (which also ends up knowing the size of the file)
+    """
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher
+
+
+def hash_file(path, algorithms, chunk_size=CHUNK_SIZE):
+    """
+    Read the given file once, in chunks, and return a dictionary
+    with the hex digest for every requested algorithm
+    """
+    return feed_file(path, MultiHasher(algorithms), chunk_size).hexdigests()
+
+
+def hash_files(jobs, workers=DEFAULT_HASH_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    Hash many files on a pool of `workers` threads (hashlib and zlib release
+    the GIL while hashing, so threads spread the work across cores).
+
+    `jobs` is a list of (key, path, algorithms, size) tuples, where size can
+    be None if unknown. Large files are hashed one per task with sequential
+    reads, while small ones are grouped in batches.
+
+    Returns a dictionary with the MultiHasher (with the digests and the size)
+    of every job, by key.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return {
+            key: feed_file(path, MultiHasher(algorithms), chunk_size)
+            for key, path, algorithms, size in jobs
+        }
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(hash_batch, batch, chunk_size) for batch in batch_jobs(jobs)
+        ]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+    return results
+
+
+def batch_jobs(jobs):
+    """
+    Group the hashing jobs: every large file is a batch on its own,
+    small files are put together until the batch is big enough
+    """
+    batch, batch_size = [], 0
+    for job in jobs:
+        size = job[3]
+        if size is None:
+            size = os.path.getsize(job[1])
+        if size >= SMALL_FILE_SIZE:
+            yield [job]
+            continue
+        batch.append(job)
+        batch_size += size
+        if batch_size >= SMALL_FILES_BATCH_SIZE or len(batch) >= SMALL_FILES_BATCH_COUNT:
+            yield batch
+            batch, batch_size = [], 0
+    if batch:
+        yield batch
+
+
+def hash_batch(batch, chunk_size=CHUNK_SIZE):
+    return {
+        key: feed_file(path, MultiHasher(algorithms), chunk_size)
+        for key, path, algorithms, size in batch
+    }
+
+
+def parse_checksum(checksum):
+    """
+    Split a "<ALGORITHM>:<VALUE>" string into the (algorithm, value) couple
+    """
+    m = CHECKSUM_PATTERN.match(checksum)
+    return m.groups()[0].lower(), m.groups()[1]
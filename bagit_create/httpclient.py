@@ -0,0 +1,242 @@
+# HTTP helpers
+# Pooled sessions with keep-alive, used by the pipelines for every request.
+# Sessions are cached per process, so jobs running one after the other in the
+# same (batch) worker reuse the already open connections. Cookies (and any
+# header added during a job) are dropped when a job releases its session,
+# so they never leak from one job to the next.
+# Every request goes through a per-host rate limiter, paced according to the
+# rate limit headers sent by the server.
+
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger("bic-basic-logger")
+
+# Seconds to wait to establish a connection and between received bytes
+DEFAULT_TIMEOUT = (10, 300)
+
+# Minimum number of connections kept open for each host
+DEFAULT_POOL_SIZE = 10
+
+# Fraction of the rate limit announced by a server that is actually used
+RATE_LIMIT_USAGE = 0.9
+# Requests that can be sent at once, before pacing kicks in
+RATE_LIMIT_BURST = 5
+# Extra wait (in percentage of the wait and flat seconds) when a host asks to
+#  stop sending requests, to avoid hitting the limit again right away
+ADDITIONAL_DELAY_PERCENTAGE = 5
+ADDITIONAL_DELAY_FLAT = 1
+# How many times a request answered with "429 Too Many Requests" is retried
+RATE_LIMIT_RETRIES = 5
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimiter:
+    """
+    Token bucket pacing the requests sent to a single host.
+
+    Until the host announces a rate limit, requests are not paced at all.
+    Every response updates the bucket from the `X-RateLimit-Remaining` (or
+    `RateLimit-Remaining`) and `X-RateLimit-Reset` headers, so the remaining
+    requests are spread (at `RATE_LIMIT_USAGE` of the allowed rate) until the
+    reset time. `Retry-After` and exhausted limits block the host until then.
+
+    The bucket is shared by all the threads of a process. Processes running
+    in parallel (e.g. batch workers) see the same headers from the server,
+    as the remaining requests count is shared server side.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.lock = threading.Lock()
+        # Tokens per second (None until the host announces a rate limit)
+        self.rate = None
+        self.tokens = RATE_LIMIT_BURST
+        self.capacity = RATE_LIMIT_BURST
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def acquire(self):
+        """
+        Wait until a request can be sent to the host
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    self.refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def update(self, response):
+        """
+        Update the pacing from the rate limit headers of a response
+        """
+        headers = response.headers
+        remaining = get_header(headers, "RateLimit-Remaining")
+        reset = get_header(headers, "RateLimit-Reset")
+        retry_after = headers.get("Retry-After")
+
+        with self.lock:
+            now = time.monotonic()
+
+            if remaining is not None and reset is not None:
+                reset_in = seconds_until(reset)
+                if remaining <= 0 and reset_in > 0:
+                    self.block(now, reset_in)
+                elif reset_in > 0:
+                    if self.rate is not None:
+                        self.refill(now)
+                    self.rate = max(remaining * RATE_LIMIT_USAGE / reset_in, 1e-3)
+                    self.capacity = max(1, min(RATE_LIMIT_BURST, remaining))
+                    self.tokens = min(self.tokens, self.capacity)
+                    self.updated = now
+
+            if retry_after is not None and response.status_code in (429, 503):
+                self.block(now, parse_retry_after(retry_after))
+
+    def block(self, now, seconds):
+        seconds += seconds / 100 * ADDITIONAL_DELAY_PERCENTAGE + ADDITIONAL_DELAY_FLAT
+        if now + seconds > self.blocked_until:
+            log.info(f"Hitting rate limits on {self.host}: waiting for {seconds:.0f}s..")
+            self.blocked_until = now + seconds
+
+
+def get_header(headers, name):
+    """
+    Returns the value of a numeric rate limit header, with or without
+    the `X-` prefix, or None if it's missing or malformed
+    """
+    value = headers.get(f"X-{name}", headers.get(name))
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def seconds_until(reset):
+    """
+    Rate limit resets are either UNIX timestamps (e.g. Zenodo, GitLab)
+    or a number of seconds
+    """
+    if reset > 1e9:
+        return reset - time.time()
+    return reset
+
+
+def parse_retry_after(value):
+    """
+    Retry-After is either a number of seconds or an HTTP date
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def get_limiter(url):
+    """
+    Returns the rate limiter of the host of the given URL
+    """
+    host = urlparse(url).netloc
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = RateLimiter(host)
+        return _limiters[host]
+
+
+class Session(requests.Session):
+    """
+    requests.Session with a default timeout and a connection pool
+    large enough for the given number of concurrent requests
+    """
+
+    def __init__(
+        self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, headers=None
+    ):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if headers:
+            self.headers.update(headers)
+        self.initial_headers = self.headers.copy()
+
+    def reset(self):
+        """
+        Drop the cookies and the headers set since the session was created,
+        keeping the open connections
+        """
+        self.cookies.clear()
+        self.headers = self.initial_headers.copy()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send the request as soon as the host rate limit allows it,
+        retrying it (after the requested wait) if the host answers with 429
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        limiter = get_limiter(url)
+
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            limiter.acquire()
+            response = super().request(method, url, **kwargs)
+            limiter.update(response)
+            if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+                return response
+            log.debug(f"{url} answered 429 Too Many Requests, retrying..")
+            if "Retry-After" not in response.headers:
+                limiter.block(time.monotonic(), 2**attempt)
+            response.close()
+
+
+def freeze(mapping):
+    """
+    Hashable version of a dictionary, to be used as cache key
+    """
+    if not mapping:
+        return ()
+    return tuple(sorted(mapping.items()))
+
+
+def get_session(headers=None, verify=True, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Returns a pooled session sending the given headers with every request.
+    The same session is returned for the same settings (see `Session.reset`
+    to release it).
+    """
+    pool_size = max(pool_size, DEFAULT_POOL_SIZE)
+    key = (freeze(headers), verify, pool_size)
+
+    with _sessions_lock:
+        if key not in _sessions:
+            session = Session(pool_size=pool_size, headers=headers)
+            session.verify = verify
+            _sessions[key] = session
+        return _sessions[key]
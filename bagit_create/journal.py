@@ -0,0 +1,52 @@
+# Job journal
+# Keeps track, next to a bag being built, of the payload files that were
+# (partially or completely) downloaded, so an interrupted job can be resumed
+# without fetching again what is already on disk
+
+import json
+import os
+import threading
+
+
+class Journal:
+    """
+    Append-only journal (one JSON object per line) of the payload files of a bag.
+    Every record has the path of the file (relative to the bag) and a status:
+    - "partial", with the `validator` (ETag or Last-Modified) of the response
+      being written, to safely continue the download with a Range request
+    - "complete", with the `size` and the `checksums` of the file
+    When a path appears more than once, the last record wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Line left half written by an interrupted job
+                        continue
+                    self.entries[record["path"]] = record
+
+    def get(self, path, status=None):
+        entry = self.entries.get(path)
+        if entry and status and entry["status"] != status:
+            return None
+        return entry
+
+    def record(self, path, status, **details):
+        entry = {"path": path, "status": status, **details}
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.entries[path] = entry
+            with open(self.path, "a") as f:
+                f.write(line)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,49 @@
+# Streaming JSON parsing
+# Read the (possibly huge) arrays of metadata documents, such as the file
+# indexes of CERN Open Data datasets, one item at a time, so memory doesn't
+# grow with the size of the document. Needs the optional ijson package:
+# without it, documents are loaded whole with the json module, giving the
+# same results.
+
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def iter_items(f, prefix):
+    """
+    Yield the values found at `prefix` in the JSON document read from the
+    (binary) file object f, in ijson notation: keys separated by dots, with
+    `item` standing for every element of an array. E.g. "results.item" yields
+    every element of the top level "results" array.
+    """
+    if ijson is not None:
+        # Numbers as floats (not Decimals), as json would load them
+        yield from ijson.items(f, prefix, use_float=True)
+        return
+
+    yield from walk(json.load(f), prefix.split(".") if prefix else [])
+
+
+def get_value(f, prefix):
+    """
+    Returns the (first) value at `prefix` (see iter_items), or None.
+    With ijson, stops reading as soon as the value is found.
+    """
+    return next(iter_items(f, prefix), None)
+
+
+def walk(value, keys):
+    if not keys:
+        yield value
+        return
+    key, rest = keys[0], keys[1:]
+    if key == "item":
+        if isinstance(value, list):
+            for element in value:
+                yield from walk(element, rest)
+    elif isinstance(value, dict) and key in value:
+        yield from walk(value[key], rest)
@@ -1,11 +1,13 @@
 import logging
 import os
 import time
+import uuid
 
 import fs
 from fs import open_fs
 
-from . import utils
+from . import cache, utils
+from .hashing import DEFAULT_HASH_WORKERS
 from .pipelines import (
     base,
     codimd,
@@ -41,6 +43,16 @@ def process(
     collection=None,
     embargo=None,
     comment=None,
+    download_workers=base.DEFAULT_DOWNLOAD_WORKERS,
+    hash_workers=DEFAULT_HASH_WORKERS,
+    full_validate=False,
+    staging="target",
+    link_mode="copy",
+    resume=False,
+    cache_dir=None,
+    cache_max_size=cache.DEFAULT_CACHE_MAX_SIZE,
+    clone_mode="full",
+    prefetched_metadata=None,
 ):
     # Save timestamp
     timestamp = int(time.time())
@@ -68,6 +80,16 @@ def process(
         "collection": collection,
         "embargo": embargo,
         "comment": comment,
+        "download_workers": download_workers,
+        "hash_workers": hash_workers,
+        "full_validate": full_validate,
+        "staging": staging,
+        "link_mode": link_mode,
+        "resume": resume,
+        "cache_dir": cache_dir,
+        "cache_max_size": cache_max_size,
+        "clone_mode": clone_mode,
+        "prefetched_metadata": prefetched_metadata is not None,
     }
 
     try:
@@ -108,7 +130,11 @@ def process(
     # create file handler logging everything
     formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     log_basepath = "/tmp"
-    log_filename = f"biclog::{recid}::{source}::{timestamp}.tmp"
+    # Unique for every job (parallel jobs may start in the same second,
+    #  and local jobs don't have a recid yet)
+    log_filename = (
+        f"biclog::{recid}::{source}::{timestamp}::{os.getpid()}-{uuid.uuid4().hex}.tmp"
+    )
     log_fullpath = f"{log_basepath}/{log_filename}"
     fh = logging.FileHandler(log_fullpath)
     fh.setLevel(10)
@@ -134,6 +160,8 @@ def process(
     try:
         # Initialize the pipeline
         pipeline = None
+        base_path = None
+        staging_path = None
         if source == "cds":
             pipeline = invenio_v1.InvenioV1Pipeline(
                 "https://cds.cern.ch/record/",
@@ -156,6 +184,8 @@ def process(
             pipeline = gitlab.GitlabPipeline(
                 "https://gitlab.cern.ch", token=token, recid=recid
             )
+            # How the repository is captured (e.g. as a single bundle file)
+            pipeline.clone_mode = clone_mode
         elif source == "cod":
             pipeline = opendata.OpenDataPipeline("http://opendata.cern.ch")
         elif source == "zenodo" or source == "inveniordm" or source == "cds-rdm-sandbox" or source == "cds-rdm":
@@ -172,6 +202,24 @@ def process(
         else:
             return {"status": 1, "errormsg": f"The given source {source} is not supported"}
 
+        # Metadata already fetched from upstream, e.g. when harvesting
+        #  the events of an Indico category (supported by Indico only)
+        if prefetched_metadata is not None:
+            pipeline.prefetched_metadata = prefetched_metadata
+
+        # Number of payload files downloaded at the same time
+        pipeline.download_workers = download_workers
+        # Number of payload files hashed at the same time
+        pipeline.hash_workers = hash_workers
+        # How local files (and bags built on another filesystem) are copied
+        pipeline.link_mode = link_mode
+
+        # Files already fetched by previous runs are taken from the cache
+        if cache_dir:
+            pipeline.cache = cache.PayloadCache(
+                cache_dir, cache.parse_size(cache_max_size)
+            )
+
         # Save job details (as audit step 0)
         audit = [
             {
@@ -188,7 +236,12 @@ def process(
         ]
 
         # Prepare empty folders
-        base_path, name = pipeline.prepare_folders(source, recid, timestamp)
+        #  (by default, in a staging folder on the same filesystem of the target)
+        staging_path = pipeline.get_staging_path(target, staging)
+        #  In resume mode, the folder of a previous failed run is reused
+        base_path, name = pipeline.prepare_folders(
+            source, recid, timestamp, staging_path=staging_path, resume=resume
+        )
 
         # Create bagit.txt
         pipeline.add_bagit_txt(f"{base_path}/bagit.txt")
@@ -272,27 +325,34 @@ def process(
 
         # Compute checksums just for the last 2 added files (the sip.json and the log file)
         #  and *append* them to the already created manifests
-        files = pipeline.create_manifests(files[-2:], base_path)
+        files[-2:] = pipeline.create_manifests(files[-2:], base_path)
 
         # Add bag-info.txt file
         #  containing the final payload size and number of files
-        pipeline.add_bag_info(base_path, f"{base_path}/bag-info.txt")
+        #  (collected while writing and hashing the payload, without scanning it again)
+        pipeline.add_bag_info(
+            base_path, f"{base_path}/bag-info.txt", pipeline.payload_sizes
+        )
 
         # Verify created package against the BagIt standard
-        pipeline.verify_bag(base_path)
+        #  (re-hashing the whole payload only if a full validation is requested)
+        pipeline.verify_bag(base_path, files, full_validate)
 
         try:
-            # Copy folder to the requested target location
-            pipeline.copy_folders(base_path, name, target)
-            # Delete temp folder
-            pipeline.delete_folder(base_path, silent_failure=False)
+            # Move folder to the requested target location
+            pipeline.publish_folder(base_path, name, target)
         except FileExistsError as e:
             # If the move fails, the original folder is deleted
             log.error(f"Job failed with error: {e}")
             pipeline.delete_folder(base_path)
+            pipeline.delete_journal()
+            pipeline.remove_staging_folder(staging_path)
 
             return {"status": 1, "errormsg": e}
 
+        pipeline.delete_journal()
+        pipeline.remove_staging_folder(staging_path)
+
         log.info("SIP successfully created")
 
         # Clear up logging handlers so subsequent executions in the same python thread
@@ -319,9 +379,18 @@ def process(
         log.error(f"Job failed with error: {e}")
 
         if pipeline:
+            # Nothing may write to the bag folder from now on
+            pipeline.cancel_background_tasks()
+
+        if pipeline and base_path and resume:
+            # Keep the folder (and its journal), so a new run can pick up
+            # from where this one stopped
+            log.error(f"Kept {base_path} to resume the job later")
+        elif pipeline and base_path:
             # Try to delete the created folder so we don't
             # leave half packages around
             pipeline.delete_folder(base_path)
+            pipeline.remove_staging_folder(staging_path)
 
         # Copy log file to the target directory
         fs.copy.copy_file(
@@ -339,3 +408,8 @@ def process(
             log.handlers.clear()
 
         return {"status": 1, "errormsg": e}
+
+    finally:
+        if pipeline:
+            # Don't keep cookies around for the next job
+            pipeline.close_session()
@@ -1,47 +1,140 @@
+import errno
+import hashlib
 import json
 import logging
 import os
 import re
 import shutil
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
-from itertools import chain
+from itertools import chain, islice
 from pathlib import Path
 from zlib import adler32
 
 import bagit
 import fs
-import requests
 from fs import open_fs
 from jsonschema import validate
 
+from .. import httpclient
+from ..entries import FileEntry, FileOrigin, dump_json
+from ..fileops import link_tree
+from ..hashing import (
+    CHUNK_SIZE,
+    DEFAULT_HASH_WORKERS,
+    MultiHasher,
+    hash_file,
+    hash_files,
+    parse_checksum,
+)
+from ..journal import Journal
 from ..version import complete_version
 
 my_fs = open_fs("/")
 
 log = logging.getLogger("bic-basic-logger")
 
-ADDITIONAL_DELAY_PERCENTAGE = 5
-ADDITIONAL_DELAY_FLAT = 1
+# Hidden folder, inside the target, where bags are built before being published
+STAGING_FOLDER = ".bic-staging"
+
+# How many payload files are downloaded at the same time by default
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+# Suffix of the journal file, kept next to the bag folder in resume mode
+JOURNAL_SUFFIX = ".journal"
+
+# How many files are hashed (and kept in memory) at a time for the manifests
+MANIFEST_WINDOW = 4096
 
 
 class BasePipeline:
+    # Checksum algorithms used for the BagIt manifests
+    algorithms = ["md5"]
+
+    # Size of the thread pool used by `run_downloads`
+    download_workers = DEFAULT_DOWNLOAD_WORKERS
+
+    # Size of the thread pool used to hash payload files for the manifests
+    hash_workers = DEFAULT_HASH_WORKERS
+
+    # How local files and staged bags are copied (see fileops.LINK_MODES)
+    link_mode = "copy"
+
+    # Journal of the downloaded payload files, set up by `prepare_folders`
+    #  only in resume mode
+    journal = None
+
+    # Cache of payload files shared across runs (see `cache.PayloadCache`)
+    cache = None
+
+    # Size of every payload file written to the bag, by bagpath, collected
+    #  while downloading, copying and hashing (see `record_payload_size`)
+    payload_sizes = None
+
+    # HTTP session used by the pipeline, taken on first use (see `session`)
+    http_session = None
+    http_session_lock = threading.Lock()
+
     def __init__(self) -> None:
         pass
 
-    def add_bag_info(self, path, dest):
+    @property
+    def session(self):
+        """
+        Pooled HTTP session to use for every request of the pipeline, sending
+        the pipeline `headers` and `cookies` and honouring `verifyssl`.
+        The pool is large enough for `download_workers` concurrent downloads.
+        Sessions are shared by the jobs of the process, one after the other:
+        see `close_session`.
+        """
+        with self.http_session_lock:
+            if self.http_session is None:
+                session = httpclient.get_session(
+                    headers=getattr(self, "headers", None),
+                    verify=getattr(self, "verifyssl", True),
+                    pool_size=int(self.download_workers),
+                )
+                cookies = getattr(self, "cookies", None)
+                if cookies:
+                    session.cookies.update(cookies)
+                self.http_session = session
+            return self.http_session
+
+    def close_session(self):
+        """
+        Release the HTTP session of the pipeline at the end of the job,
+        dropping the cookies and headers set during the job (the pooled
+        connections are kept for the next jobs)
+        """
+        with self.http_session_lock:
+            if self.http_session is not None:
+                self.http_session.reset()
+                self.http_session = None
+
+    def add_bag_info(self, path, dest, payload_sizes=None):
         """
         The "bag-info.txt" file is a tag file that contains metadata elements
         describing the bag and the payload. The metadata elements contained
         in the "bag-info.txt" file are intended primarily for human use.
+
+        The Payload-Oxum is computed from the given sizes of the payload files
+        (by bagpath), if any, otherwise by scanning the payload folder.
         """
 
-        payload_path = Path(f"{path}/data")
         today = date.today()
         d = today.strftime("%Y-%m-%d")
 
-        file_count = sum(len(files) for _, _, files in os.walk(payload_path))
-        size = sum(f.stat().st_size for f in payload_path.glob("**/*") if f.is_file())
+        if payload_sizes is not None:
+            file_count = len(payload_sizes)
+            size = sum(payload_sizes.values())
+        else:
+            payload_path = Path(f"{path}/data")
+            file_count = sum(len(files) for _, _, files in os.walk(payload_path))
+            size = sum(
+                f.stat().st_size for f in payload_path.glob("**/*") if f.is_file()
+            )
 
         baginfo = (
             f"Bag-Software-Agent: bagit-create {complete_version}"
@@ -65,18 +158,253 @@ class BasePipeline:
         except Exception as err:
             log.error("sip.json validation failed with error", err)
 
-    def downloadRemoteFile(self, src, dest, headers={}):
-        r = requests.get(src, headers=headers)
-        with open(dest, "wb") as f:
-            f.write(r.content)
-        return True
+    def downloadRemoteFile(self, src, dest, headers={}, hasher=None):
+        return self.download_file(src, dest, headers, hasher, raise_for_status=False)
 
-    def downloadEOSfile(self, src, dest):
+    def downloadEOSfile(self, src, dest, hasher=None):
         try:
-            my_fs.copy(src, dest)
+            with my_fs.openbin(src) as source, open(dest, "wb") as f:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    if hasher:
+                        hasher.update(chunk)
         except (FileNotFoundError, fs.errors.ResourceNotFound):
             log.debug(f"  Path '{src}' not found. Skipping file. ")
             return False
+        return True
+
+    def run_downloads(self, files, tasks):
+        """
+        Run a list of download tasks on a pool of `download_workers` threads.
+
+        Every task is a (idx, destination, fetch) tuple, where `fetch` is called
+        with the destination path and a `hasher` and returns True if the file was
+        downloaded. `fetch` must feed every written chunk to the hasher, so the
+        checksums needed by the manifests are computed while downloading.
+
+        The result and the computed checksums are saved in `files[idx]` from the
+        calling thread only, so the files object is never modified concurrently.
+
+        If any download raises, the pending tasks are cancelled, the running ones
+        are waited for and the exception is raised again.
+        """
+        if not tasks:
+            return files
+
+        workers = max(1, min(int(self.download_workers), len(tasks)))
+        log.debug(f"Running {len(tasks)} downloads on {workers} workers..")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    self.run_download_task, files[idx], destination, fetch
+                ): idx
+                for idx, destination, fetch in tasks
+            }
+            try:
+                for future in as_completed(futures):
+                    idx = futures[future]
+                    downloaded, checksums, size = future.result()
+                    files[idx]["downloaded"] = downloaded
+                    if downloaded:
+                        self.add_checksums(files[idx], checksums)
+                        self.record_payload_size(files[idx], size)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        if self.cache is not None:
+            self.cache.evict()
+
+        return files
+
+    def run_download_task(self, sourcefile, destination, fetch):
+        """
+        Download a single file, hashing it on the fly with the manifest algorithms
+        and with the ones of any checksum coming from upstream.
+        Upstream checksums are verified as soon as the download is over.
+
+        Returns a (downloaded, checksums, size) tuple.
+        """
+        upstream = self.get_upstream_checksums(sourcefile)
+
+        # In resume mode, skip files completely downloaded by a previous run
+        done = self.get_completed_download(destination, upstream)
+        if done:
+            log.debug(f"{done['path']} was already downloaded. Skipping file.")
+            return True, done["checksums"], done["size"]
+
+        # Files with upstream checksums may already be in the payload cache
+        checksums = self.get_cached_download(sourcefile, destination, upstream)
+
+        if checksums is None:
+            hasher = MultiHasher(
+                self.algorithms + [alg for alg in upstream if alg not in self.algorithms]
+            )
+
+            # The destination may be a hardlink to a file in the payload cache
+            #  (e.g. a bag folder being built again): fetchers writing it in
+            #  place would change the cached copy too
+            self.unlink_shared_file(destination)
+
+            downloaded = fetch(destination, hasher=hasher)
+            if not downloaded:
+                return downloaded, {}, None
+
+            checksums = hasher.hexdigests()
+            for alg, expected in upstream.items():
+                if checksums[alg] != expected.lower():
+                    raise ChecksumMismatchException(
+                        f"Checksum mismatch for {destination}: upstream {alg} is"
+                        f" {expected}, downloaded file has {checksums[alg]}"
+                    )
+
+            if self.cache is not None:
+                self.cache.store(destination, checksums)
+            size = hasher.size
+        else:
+            size = os.path.getsize(destination)
+
+        if self.journal is not None:
+            self.journal.record(
+                self.journal_key(destination),
+                "complete",
+                size=size,
+                checksums=checksums,
+            )
+        return True, checksums, size
+
+    def unlink_shared_file(self, path):
+        """
+        Remove the file at path if it's hardlinked somewhere else.
+        Partially downloaded files (never shared) are kept, to be resumed.
+        """
+        try:
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get_cached_download(self, sourcefile, destination, upstream):
+        """
+        If a file matching the upstream checksums is in the payload cache,
+        link (or copy) it to the destination and return its checksums.
+        Returns None if there's no cache or the file is not there.
+        """
+        if self.cache is None or not upstream:
+            return None
+
+        found = self.cache.lookup(upstream, sourcefile.get("size"))
+        if found is None:
+            return None
+
+        path, entry = found
+        try:
+            self.cache.materialize(path, destination)
+        except FileNotFoundError:
+            # Evicted by another job in the meantime
+            log.debug(f"{path} left the cache, downloading the file..")
+            return None
+
+        checksums = dict(entry["checksums"])
+        missing = [alg for alg in self.algorithms if alg not in checksums]
+        if missing:
+            checksums.update(hash_file(destination, missing))
+        return checksums
+
+    def record_payload_size(self, sourcefile, size):
+        """
+        Remember the size of a payload file written to the bag,
+        to compute the Payload-Oxum without scanning the bag again
+        """
+        if size is None or "bagpath" not in sourcefile:
+            return
+        if self.payload_sizes is None:
+            self.payload_sizes = {}
+        self.payload_sizes[sourcefile["bagpath"]] = int(size)
+
+    def has_payload_size(self, sourcefile):
+        return (
+            self.payload_sizes is not None
+            and sourcefile["bagpath"] in self.payload_sizes
+        )
+
+    def journal_key(self, path):
+        """
+        Path of a file of the bag, as recorded in the journal
+        """
+        return os.path.relpath(path, self.base_path)
+
+    def get_completed_download(self, destination, upstream={}):
+        """
+        Returns the journal entry of the given file if it was completely
+        downloaded by a previous run (and it still matches the size on disk and
+        the upstream checksums), None otherwise
+        """
+        if self.journal is None:
+            return None
+
+        entry = self.journal.get(self.journal_key(destination), "complete")
+        if not entry or not os.path.isfile(destination):
+            return None
+        if os.path.getsize(destination) != entry["size"]:
+            return None
+        for alg, expected in upstream.items():
+            if entry["checksums"].get(alg) != expected.lower():
+                return None
+        return entry
+
+    def get_resume_offset(self, dest):
+        """
+        Returns the size of the partially downloaded file at the given path and
+        the validator (ETag or Last-Modified) of the response it comes from.
+        (0, None) if the download can't be resumed.
+        """
+        if self.journal is None or not os.path.isfile(dest):
+            return 0, None
+
+        entry = self.journal.get(self.journal_key(dest), "partial")
+        if not entry:
+            return 0, None
+        return os.path.getsize(dest), entry.get("validator")
+
+    def get_upstream_checksums(self, sourcefile):
+        """
+        Returns a dictionary with the checksums of the given file found in the
+        metadata, limited to the algorithms that can be computed locally
+        """
+        if "checksum" not in sourcefile:
+            return {}
+
+        available = sourcefile["checksum"]
+        if type(available) == str:
+            available = [available]
+
+        upstream = {}
+        for avail_checksum in available:
+            alg, value = parse_checksum(avail_checksum)
+            if value and (alg == "adler32" or alg in hashlib.algorithms_available):
+                upstream[alg] = value
+        return upstream
+
+    def add_checksums(self, sourcefile, checksums):
+        """
+        Add the computed checksums of the manifest algorithms to the given file,
+        unless a checksum for the same algorithm is already there
+        """
+        if "checksum" not in sourcefile:
+            sourcefile["checksum"] = []
+        elif type(sourcefile["checksum"]) == str:
+            sourcefile["checksum"] = [sourcefile["checksum"]]
+
+        known = [parse_checksum(c)[0] for c in sourcefile["checksum"]]
+        for alg in self.algorithms:
+            if alg in checksums and alg not in known:
+                sourcefile["checksum"].append(f"{alg}:{checksums[alg]}")
 
     def adler32sum(self, filepath):
         """
@@ -108,6 +436,13 @@ class BasePipeline:
     def get_metadata(self, recid):
         return None
 
+    def cancel_background_tasks(self):
+        """
+        Stop (and wait for) any work the pipeline is doing in the background,
+        e.g. before deleting the folder of a failed job
+        """
+        pass
+
     def delete_folder(self, path, silent_failure=True):
         """
         Delete given folder.
@@ -129,39 +464,98 @@ class BasePipeline:
             open(f"{dest}", "ab").write(content)
         elif type(content) is dict:
             # Serialize to JSON with Unicode Data as-is into an UTF-8 encoded file
-            open(f"{dest}", "a", encoding="utf-8").write(
-                json.dumps(content, indent=4, ensure_ascii=False)
-            )
+            #  (File entries are turned into plain dictionaries here, one at a time)
+            with open(f"{dest}", "a", encoding="utf-8") as f:
+                dump_json(content, f)
         else:
             open(f"{dest}", "a").write(content)
         log.info(f"Wrote {os.path.basename(dest)}")
         log.debug(f"({dest})")
 
-    def download_file(self, sourcefile, dest, headers={}):
-        with requests.get(sourcefile, stream=True, headers=headers) as r:
-            r.raise_for_status()
-            with open(dest, "wb") as f:
-                for chunk in r.iter_content(chunk_size=512 * 1024):
+    def download_file(
+        self, sourcefile, dest, headers={}, hasher=None, raise_for_status=True
+    ):
+        """
+        Download the given URL to `dest`, feeding every chunk to the hasher.
+
+        In resume mode, a file left partially downloaded by a previous run is
+        continued with a Range request (and the already downloaded bytes are
+        hashed again from disk). If the remote file changed in the meantime
+        (or the server doesn't honour the range) the file is downloaded again.
+        """
+        request_headers = dict(headers)
+        offset, validator = self.get_resume_offset(dest)
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+            if validator:
+                request_headers["If-Range"] = validator
+
+        with self.session.get(sourcefile, stream=True, headers=request_headers) as r:
+            resumed = (
+                offset
+                and r.status_code == 206
+                and r.headers.get("Content-Range", "").startswith(f"bytes {offset}-")
+            )
+            # 416: the partial file is not shorter than the remote one
+            # 206 for another range: the body is only a part of the file
+            if offset and not resumed and r.status_code in (206, 416):
+                # Start over
+                log.debug(f"Unable to resume {dest}, downloading it again..")
+                os.remove(dest)
+                return self.download_file(
+                    sourcefile, dest, headers, hasher, raise_for_status
+                )
+            if raise_for_status:
+                r.raise_for_status()
+
+            if resumed:
+                log.debug(f"Resuming download of {dest} from byte {offset}..")
+                if hasher:
+                    self.hash_partial_file(dest, offset, hasher)
+            else:
+                self.journal_partial_download(dest, r)
+                # Don't write through a hardlink to a cached file
+                if os.path.exists(dest):
+                    os.remove(dest)
+
+            with open(dest, "ab" if resumed else "wb") as f:
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
                     if chunk:  # filter out keep-alive new chunks
                         f.write(chunk)
-            if "X-RateLimit-Remaining" and "X-RateLimit-Reset" in r.headers:
-                elapsed_time_to_reset = int(r.headers["X-RateLimit-Reset"]) - int(
-                    time.time()
-                )
-                log.debug(
-                    f"Rate limits: {r.headers['X-RateLimit-Remaining']} remaining requests. Resetting in {elapsed_time_to_reset}s"
-                )
-                if int(r.headers["X-RateLimit-Remaining"]) < 5:
-                    log.info(
-                        f"Hitting rate limits: waiting for {elapsed_time_to_reset}s.."
-                    )
-                    time.sleep(
-                        elapsed_time_to_reset +
-                        elapsed_time_to_reset / 100 * ADDITIONAL_DELAY_PERCENTAGE +
-                        ADDITIONAL_DELAY_FLAT
-                    )
+                        if hasher:
+                            hasher.update(chunk)
         return True
 
+    def journal_partial_download(self, dest, response):
+        """
+        Record in the journal that the given file is being downloaded, if the
+        server allows to resume it later with a Range request
+        """
+        if self.journal is None:
+            return
+
+        # Ranges refer to the encoded content, while the decoded one is saved
+        resumable = response.headers.get(
+            "Accept-Ranges"
+        ) == "bytes" and not response.headers.get("Content-Encoding")
+        if resumable:
+            validator = response.headers.get("ETag") or response.headers.get(
+                "Last-Modified"
+            )
+            self.journal.record(self.journal_key(dest), "partial", validator=validator)
+
+    def hash_partial_file(self, path, size, hasher):
+        """
+        Feed the first `size` bytes of the given file to the hasher
+        """
+        with open(path, "rb") as f:
+            while size > 0:
+                chunk = f.read(min(CHUNK_SIZE, size))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                size -= len(chunk)
+
     def add_bagit_txt(self, dest, version="0.97", encoding="UTF-8"):
         """
         Creates "bagit.txt", the Bag Declaration file (BagIt specification)
@@ -178,12 +572,7 @@ class BasePipeline:
         """
         Compute hash of a given file
         """
-        if alg == "adler32":
-            computedhash = self.adler32sum(filename)
-        else:
-            computedhash = my_fs.hash(filename, alg)
-
-        return computedhash
+        return hash_file(filename, [alg])[alg]
 
     def generate_manifest(self, files, algorithm, basepath):
         """
@@ -199,44 +588,125 @@ class BasePipeline:
         there at all), compute the checksums on the downloaded files (found
         appending the filaname to the given base path) and add them to the SIP metadata.
         """
-        contents = ""
+        contents, files = self.generate_manifests(files, [algorithm], basepath)
+        return contents[algorithm], files
 
-        for idx, file in enumerate(files):
-            checksum = None
-            # Check if there's the "checksum" value in the File
-            if "checksum" in file:
-                # If it's a string create a single element list out of it
-                if type(file["checksum"]) == str:
-                    file["checksum"] = [file["checksum"]]
-                # For each available checksum
-                for avail_checksum in file["checksum"]:
-                    p = re.compile(r"([A-z0-9]*):([A-z0-9]*)")
-                    m = p.match(avail_checksum)
-                    alg = m.groups()[0].lower()
-                    matched_checksum = m.groups()[1]
-                    # Check if it's the required one
-                    if alg == algorithm:
-                        checksum = matched_checksum
-
-            # If we didn't find the required checksum but the file has been downloaded,
-            #  compute it
-            if not checksum and file["downloaded"]:
-                path = f"{basepath}/{file['bagpath']}"
-                checksum = self.compute_hash(path, algorithm)
-                # Add the newly computed checksum to the SIP metadata
-                if "checksum" in files[idx]:
-                    files[idx]["checksum"].append(f"{algorithm}:{checksum}")
-                else:
-                    files[idx]["checksum"] = [f"{algorithm}:{checksum}"]
+    def generate_manifests(self, files, algorithms, basepath):
+        """
+        Same as `generate_manifest`, but for several algorithms at once.
 
-            # If there's no checksum and it's not possibile to compute it from disk, throw an error
-            if not checksum and not file["downloaded"]:
-                continue
+        Returns a dictionary with the manifest contents for each algorithm
+        and the list of the updated files (`files` can be any iterable, it is
+        consumed).
+        """
+        lines = {alg: [] for alg in algorithms}
+        processed = []
+        for file, checksums in self.iter_manifest_entries(files, algorithms, basepath):
+            processed.append(file)
+            for alg in algorithms:
+                if alg in checksums:
+                    lines[alg].append(f"{checksums[alg]} {file['bagpath']}\n")
 
-            line = f"{checksum} {file['bagpath']}\n"
-            contents += line
+        return {alg: "".join(lines[alg]) for alg in algorithms}, processed
 
-        return contents, files
+    def iter_manifest_entries(self, files, algorithms, basepath):
+        """
+        Yield a (file, checksums) couple for every given file (list or any
+        iterable), with the checksums of the requested algorithms that are
+        available for it, in the same order.
+
+        Every file missing some of the requested checksums is read only once,
+        computing all the missing digests in the same pass (and adding them to
+        the SIP metadata). Files are taken in windows of `MANIFEST_WINDOW`,
+        each one hashed on `hash_workers` threads, so memory use doesn't grow
+        with the number of files.
+        The size of every listed file is recorded as well, for the
+        Payload-Oxum (from the download or the hashing pass, or with a single
+        stat otherwise).
+        """
+        files = iter(files)
+        while True:
+            window = list(islice(files, MANIFEST_WINDOW))
+            if not window:
+                break
+
+            found = []
+            jobs = []
+            for idx, file in enumerate(window):
+                checksums = {}
+                # Check if there's the "checksum" value in the File
+                if "checksum" in file:
+                    # If it's a string create a single element list out of it
+                    if type(file["checksum"]) == str:
+                        file["checksum"] = [file["checksum"]]
+                    # Keep the available checksums of the required algorithms
+                    for avail_checksum in file["checksum"]:
+                        alg, matched_checksum = parse_checksum(avail_checksum)
+                        if alg in algorithms and matched_checksum:
+                            checksums[alg] = matched_checksum
+                found.append(checksums)
+
+                # If we didn't find some of the required checksums but the file
+                #  has been downloaded, compute them all with a single read
+                missing = [alg for alg in algorithms if alg not in checksums]
+                if missing and file["downloaded"]:
+                    size = (self.payload_sizes or {}).get(file["bagpath"])
+                    path = f"{basepath}/{file['bagpath']}"
+                    jobs.append((idx, path, missing, size))
+
+            hashed = hash_files(jobs, int(self.hash_workers))
+
+            for idx, file in enumerate(window):
+                checksums = found[idx]
+                if idx in hashed:
+                    self.record_payload_size(file, hashed[idx].size)
+                    for alg, value in hashed[idx].hexdigests().items():
+                        checksums[alg] = value
+                        # Add the newly computed checksum to the SIP metadata
+                        if "checksum" in file:
+                            file["checksum"].append(f"{alg}:{value}")
+                        else:
+                            file["checksum"] = [f"{alg}:{value}"]
+
+                if file["downloaded"] and not self.has_payload_size(file):
+                    try:
+                        path = f"{basepath}/{file['bagpath']}"
+                        self.record_payload_size(file, os.path.getsize(path))
+                    except OSError:
+                        log.debug(f"{file['bagpath']} not found, size unknown")
+
+                # If there's no checksum and it's not possibile to compute it
+                #  from disk, the file won't be listed
+                yield file, checksums
+
+    def create_manifests(self, files, base_path):
+        """
+        Write (or append to) a manifest file for every algorithm
+        supported by the pipeline, line by line as files are processed.
+
+        Returns the list of the updated files (`files` can be any iterable,
+        it is consumed).
+        """
+        log.info(f"Generating manifests {', '.join(self.algorithms)}..")
+        manifests = {
+            alg: open(f"{base_path}/manifest-{alg}.txt", "a") for alg in self.algorithms
+        }
+        processed = []
+        try:
+            for file, checksums in self.iter_manifest_entries(
+                files, self.algorithms, base_path
+            ):
+                processed.append(file)
+                for alg, manifest in manifests.items():
+                    if alg in checksums:
+                        manifest.write(f"{checksums[alg]} {file['bagpath']}\n")
+        finally:
+            for manifest in manifests.values():
+                manifest.close()
+
+        for alg in self.algorithms:
+            log.info(f"Wrote manifest-{alg}.txt")
+        return processed
 
     def generate_fetch_txt(self, files, source):
         """
@@ -249,7 +719,12 @@ class BasePipeline:
         ...
 
         """
-        contents = ""
+        return "".join(self.iter_fetch_lines(files, source))
+
+    def iter_fetch_lines(self, files, source):
+        """
+        Yield the fetch.txt line of every given file (see `generate_fetch_txt`)
+        """
         for file in files:
             try:
                 if source == "local":
@@ -284,39 +759,127 @@ class BasePipeline:
             # from the filename extracted from the URL
             # (e.g. see how Invenio3 pipeline handles filenames with slashes)
 
-            line = f'{param} {file["size"]} {file["origin"]["path"]}{file["bagpath"]}\n'
-            contents += line
-        return contents
+            yield f'{param} {file["size"]} {file["origin"]["path"]}{file["bagpath"]}\n'
 
     def create_fetch_txt(self, files, source, dest):
-        content = self.generate_fetch_txt(files, source)
-        self.write_file(content, dest)
+        """
+        Write (or append to) the fetch.txt file, line by line
+        """
+        with open(dest, "a") as f:
+            f.writelines(self.iter_fetch_lines(files, source))
+        log.info(f"Wrote {os.path.basename(dest)}")
+        log.debug(f"({dest})")
+
+    def get_staging_path(self, target, staging="target"):
+        """
+        Returns the folder where the bag is built before being published.
+        With the "target" staging mode the bag is built in a hidden folder inside
+        the target, so it's on the same filesystem and can be published with
+        a rename. With "tmp", it is built in /tmp and copied to the target.
+        """
+        if staging == "tmp":
+            return "/tmp"
 
-    def prepare_folders(self, source, recid, timestamp, delimiter_str="::"):
-        # Sometimes we don't have write permissions on the cwd,
-        #  so let's prepare things in /tmp
-        path = "/tmp"
+        staging_path = f"{target}/{STAGING_FOLDER}"
+        os.makedirs(staging_path, exist_ok=True)
+        return staging_path
+
+    def prepare_folders(
+        self,
+        source,
+        recid,
+        timestamp,
+        delimiter_str="::",
+        staging_path="/tmp",
+        resume=False,
+    ):
+        """
+        Create the (empty) bag folder in the staging path.
+
+        In resume mode, a journal is kept next to the bag folder and the folder
+        left by a previous failed run for the same source and record, if any,
+        is reused (renamed after the new timestamp).
+        """
+        path = staging_path
 
         # Prepare the base folder for the BagIt export
         #  e.g. "bagitexport::cds::42::4320197"
-        base_name = (
-            f"sip{delimiter_str}{source}{delimiter_str}{recid}{delimiter_str}{timestamp}"
-        )
+        prefix = f"sip{delimiter_str}{source}{delimiter_str}{recid}{delimiter_str}"
+        base_name = f"{prefix}{timestamp}"
         base_path = f"{path}/{base_name}"
 
-        os.mkdir(base_path)
-
-        # Create a 'data/' subfolder (bagit payload)
-        os.mkdir(f"{base_path}/data")
-        os.mkdir(f"{base_path}/data/meta")
-        os.mkdir(f"{base_path}/data/content")
+        previous = self.find_resumable_folder(path, prefix) if resume else None
+        if previous:
+            log.info(f"Resuming job from {os.path.basename(previous)}..")
+            os.rename(f"{previous}{JOURNAL_SUFFIX}", f"{base_path}{JOURNAL_SUFFIX}")
+            os.rename(previous, base_path)
+        else:
+            while True:
+                # The staging folder is shared with other jobs, which remove it
+                #  when they find it empty (see remove_staging_folder)
+                os.makedirs(path, exist_ok=True)
+                try:
+                    os.mkdir(base_path)
+                    break
+                except FileNotFoundError:
+                    # Removed right before creating the bag folder, try again
+                    continue
 
         self.base_path = base_path
+        self.payload_sizes = {}
+
+        if resume:
+            self.journal = Journal(f"{base_path}{JOURNAL_SUFFIX}")
+            if previous:
+                self.clean_resumed_folder(base_path)
+            else:
+                # Create the journal file right away, to mark the folder as resumable
+                open(self.journal.path, "a").close()
+
+        # Create a 'data/' subfolder (bagit payload)
+        os.makedirs(f"{base_path}/data/meta", exist_ok=True)
+        os.makedirs(f"{base_path}/data/content", exist_ok=True)
 
         log.debug(f"Bag folder: {base_name}")
 
         return base_path, base_name
 
+    def find_resumable_folder(self, path, prefix):
+        """
+        Returns the most recent bag folder in the given path starting with the
+        given prefix and having a journal, None if there's none
+        """
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            # Staging folder removed by another job, as it was empty
+            return None
+        candidates = [
+            name
+            for name in names
+            if name.startswith(prefix)
+            and not name.endswith(JOURNAL_SUFFIX)
+            and os.path.isfile(f"{path}/{name}{JOURNAL_SUFFIX}")
+        ]
+        if not candidates:
+            return None
+        latest = max(candidates, key=lambda name: os.path.getmtime(f"{path}/{name}"))
+        return f"{path}/{latest}"
+
+    def clean_resumed_folder(self, base_path):
+        """
+        Remove from a resumed bag folder everything that isn't a payload file
+        recorded in the journal (tag files, logs, metadata, incomplete files
+        that can't be resumed), as it will be created again
+        """
+        for dirpath, dirnames, filenames in os.walk(base_path, topdown=False):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                if self.journal.get(self.journal_key(filepath)) is None:
+                    os.remove(filepath)
+            if dirpath != base_path and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
     def prepare_AIC(self, base_path, recid, timestamp=0, delimiter_str="::"):
         log.info("Creating AIC..")
         # Set timestamp to now if 0 is passed
@@ -419,27 +982,21 @@ class BasePipeline:
                 }
             )
 
-        bic_log_file_entry = {
-            "origin": {
-                "filename": "bagitcreate.log",
-                "path": "",
-            },
-            "metadata": False,
-            "downloaded": True,
-            "bagpath": "data/meta/bagitcreate.log",
-        }
+        bic_log_file_entry = FileEntry(
+            origin=FileOrigin(filename="bagitcreate.log", path=""),
+            metadata=False,
+            downloaded=True,
+            bagpath="data/meta/bagitcreate.log",
+        )
 
         files.append(bic_log_file_entry)
 
-        bic_meta_file_entry = {
-            "origin": {
-                "filename": "sip.json",
-                "path": "",
-            },
-            "metadata": False,
-            "downloaded": True,
-            "bagpath": "data/meta/sip.json",
-        }
+        bic_meta_file_entry = FileEntry(
+            origin=FileOrigin(filename="sip.json", path=""),
+            metadata=False,
+            downloaded=True,
+            bagpath="data/meta/sip.json",
+        )
 
         files.append(bic_meta_file_entry)
 
@@ -447,19 +1004,63 @@ class BasePipeline:
 
         return files
 
-    def verify_bag(self, path):
+    def verify_bag(self, path, files=None, full_validate=False):
+        """
+        Validate the created Bag.
+
+        By default (when the files object is given) payload files are not read
+        again: the structure, the Payload-Oxum and the manifests completeness are
+        checked by bagit, and every manifest entry is cross-checked against the
+        checksums computed while creating the bag.
+        With `full_validate`, bagit re-hashes every payload file instead.
+        """
         log.info(f"\n--\nValidating created Bag {path} ..")
         bag = bagit.Bag(path)
         valid = False
         try:
-            valid = bag.validate()
+            if full_validate or files is None:
+                valid = bag.validate()
+            else:
+                valid = bag.validate(completeness_only=True)
+                self.verify_manifest_entries(bag, files)
         except bagit.BagValidationError as err:
             log.error(f"Bag validation failed: {err}")
+            valid = False
         if valid:
             log.info("Bag successfully validated")
         log.info("--\n")
         return valid
 
+    def verify_manifest_entries(self, bag, files):
+        """
+        Check that every checksum in the manifests of the given bag matches
+        the ones saved in the files object
+        """
+        known = {}
+        for file in files:
+            if "bagpath" not in file or "checksum" not in file:
+                continue
+            available = file["checksum"]
+            if type(available) == str:
+                available = [available]
+            for avail_checksum in available:
+                alg, value = parse_checksum(avail_checksum)
+                known.setdefault(file["bagpath"], {})[alg] = value
+
+        errors = []
+        for bagpath, entry in bag.entries.items():
+            # Skip tag manifests entries
+            if not bagpath.startswith("data/"):
+                continue
+            for alg, expected in entry.items():
+                found = known.get(bagpath, {}).get(alg)
+                if found is None or found.lower() != expected.lower():
+                    errors.append(bagit.ChecksumMismatch(bagpath, alg, expected, found))
+
+        if errors:
+            raise bagit.BagValidationError("Manifests do not match the SIP metadata", errors)
+        return True
+
     def copy_folders(self, base_path, name, target):
         log.info(f"Copying files to {target} ..")
 
@@ -470,7 +1071,52 @@ class BasePipeline:
         target_path = f"{target}/{name}"
 
         # copy folder to the target location
-        shutil.copytree(base_path, target_path)
+        #  (linking files instead, if the link mode and the filesystems allow it)
+        methods = link_tree(base_path, target_path, self.link_mode)
+        log.debug(f"Files copied by method: {methods}")
+
+    def publish_folder(self, base_path, name, target):
+        """
+        Move the bag from the staging folder to the target location.
+        This is an atomic rename when both are on the same filesystem;
+        otherwise the bag is copied and the staged one deleted.
+        """
+        target_path = f"{target}/{name}"
+
+        if os.path.exists(target_path):
+            raise FileExistsError(f"{target_path} already exists")
+
+        os.makedirs(target, exist_ok=True)
+
+        try:
+            os.rename(base_path, target_path)
+            log.info(f"Moved bag to {target}")
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self.copy_folders(base_path, name, target)
+            self.delete_folder(base_path, silent_failure=False)
+
+        return target_path
+
+    def delete_journal(self):
+        """
+        Delete the journal (if any), once the job is over
+        """
+        if self.journal is not None:
+            self.journal.delete()
+
+    def remove_staging_folder(self, staging_path):
+        """
+        Remove the staging folder created inside the target, if empty
+        (other jobs may still be building their bags there)
+        """
+        if os.path.basename(staging_path) != STAGING_FOLDER:
+            return
+        try:
+            os.rmdir(staging_path)
+        except OSError:
+            pass
 
     # Checks the input from the cli and raises error if there is a mistake
     def check_parameters_input(
@@ -537,3 +1183,8 @@ class BasePipeline:
 class WrongInputException(Exception):
     # This exception handles wrong cli commands
     pass
+
+
+class ChecksumMismatchException(Exception):
+    # This exception handles downloaded files not matching the upstream checksum
+    pass
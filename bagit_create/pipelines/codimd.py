@@ -2,18 +2,21 @@ import logging
 import re
 import urllib.parse
 
-import requests
 from slugify import slugify
 
+from ..entries import FileEntry, FileOrigin
 from . import base
 
 log = logging.getLogger("bic-basic-logger")
 
 
 class CodimdPipeline(base.BasePipeline):
+    algorithms = ["md5", "sha1"]
+
     def __init__(self, recid, token=None):
         self.connect_sid_token = token
         self.recid = recid
+        self.cookies = {"connect.sid": token}
 
     def get_metadata(self, record_id, source):
         # We don't have any metadata fetch-able via exposed routes, so let's
@@ -31,24 +34,23 @@ class CodimdPipeline(base.BasePipeline):
         files = [{"downloaded": True}]
 
         # File entry for the metadata file
-        meta_file_entry = {
-            "origin": {
-                "filename": f"codimd-{self.recid}.json",
-                "path": "",
-                "url": "",
-            },
-            "metadata": True,
-            "downloaded": True,
-            "bagpath": f"data/content/codimd-{self.recid}.json",
-        }
+        meta_file_entry = FileEntry(
+            origin=FileOrigin(
+                filename=f"codimd-{self.recid}.json",
+                path="",
+                url="",
+            ),
+            metadata=True,
+            downloaded=True,
+            bagpath=f"data/content/codimd-{self.recid}.json",
+        )
         files.append(meta_file_entry)
         return (files, meta_file_entry)
 
     def download_files(self, files, base_path):
-        r = requests.get(
+        r = self.session.get(
             f"https://codimd.web.cern.ch/{self.recid}/download",
             stream=True,
-            cookies={"connect.sid": self.connect_sid_token},
         )
 
         if r.status_code == 404:
@@ -75,10 +77,9 @@ class CodimdPipeline(base.BasePipeline):
                     f.write(chunk)
         files[0]["bagpath"] = f"data/content/{fname}"
 
-        r = requests.get(
+        r = self.session.get(
             f"https://codimd.web.cern.ch/{self.recid}/pdf",
             stream=True,
-            cookies={"connect.sid": self.connect_sid_token},
         )
 
         with open(f"{base_path}/data/content/{fname[:-3]}.pdf", "wb") as f:
@@ -94,11 +95,3 @@ class CodimdPipeline(base.BasePipeline):
         files.append(pdf_file_entry)
 
         return files
-
-    def create_manifests(self, files, base_path):
-        algs = ["md5", "sha1"]
-        for alg in algs:
-            log.info(f"Generating manifest {alg}..")
-            content, files = self.generate_manifest(files, alg, base_path)
-            self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
@@ -1,33 +1,61 @@
-import json
 import logging
 import ntpath
 import os
 import shutil
 import subprocess
+import tarfile
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from urllib.parse import quote
 
-import requests
-
+from ..entries import FileEntry, FileOrigin
+from ..hashing import CHUNK_SIZE, MultiHasher
+from ..jsonstream import iter_items
 from . import base
 from .local import LocalV1Pipeline
 
 log = logging.getLogger("bic-basic-logger")
 
+# Results per page of the repository tree listing (the maximum allowed by GitLab)
+TREE_PAGE_SIZE = 100
+
+# How the repository is captured in the SIP
+#  full: complete clone, with the whole history
+#  shallow: clone of the latest commit only
+#  partial: complete history, without the old versions of large files
+#  bundle: the whole repository (every ref) as a single git bundle file
+CLONE_MODES = ["full", "shallow", "partial", "bundle"]
+
+# git clone options of every mode
+CLONE_OPTIONS = {
+    "full": [],
+    "shallow": ["--depth", "1"],
+    "partial": ["--filter=blob:limit=1m"],
+    "bundle": ["--mirror"],
+}
+
 
 class GitlabPipeline(base.BasePipeline):
+    algorithms = ["sha256"]
+
     def __init__(self, base_url, recid, token=None):
         log.info(f"Gitlab pipeline initialised.\nBase URL: {base_url}")
         self.base_url = base_url
         self.source = "gitlab"
         self.recid = recid
-        self.current_time_elapsed = 0  # Keeps track of the seconds elapsed since the repeated api requests have started
         self.interval_seconds = (
-            10  # Every 10 seconds triggers a new request to gitlab server
+            1  # Seconds before the first check of the export, doubled after every check
         )
+        self.max_interval_seconds = 30  # Longest wait between two checks
         self.total_seconds_allowed = (
             600  # Repeated requests should not run for more than 600 seconds (10 mins)
         )
+        self.export = None  # Future result of the export running in the background
+        self.export_thread = None
+        self.export_cancelled = threading.Event()  # Set to stop the export
+        self.clone_mode = "full"  # See CLONE_MODES
         self.metadata_filename = f"metadata-{self.source}-{self.recid}.json"
 
         # Prepare call Gitlab API
@@ -49,33 +77,15 @@ class GitlabPipeline(base.BasePipeline):
         Returns: [metadata_serialized, metadata_upstream_url, operation_status_code]
         """
 
+        # Request the export package first, so GitLab prepares it (and it gets
+        #  downloaded) while the tree is listed and the repository is cloned
+        self.start_export()
+
         # Gitlab API export base endpoint
         endpoint = f"{self.base_url}/api/v4/projects/{record_id}/repository/tree"
 
-        # Query params
-        # Gitlab API returns paginated results by default. Additional API calls must be done to make sure all the files are fetched
-        current_page = 1
-
-        # Gets the metadata and each file path from gitlab (will only return the first page)
-        response = self.make_api_request(endpoint, current_page, self.headers)
-
-        # Gets the total pages that need to be returned in total and saves it
-        total_pages = int(response.headers["X-Total-Pages"])
-
-        # Saves the received content and the response url
-        results_files = response.json()
-        results_dict = results_files[0]
-
-        # If there are more pages
-        while current_page < total_pages:
-            current_page += 1
-            # Increase page by one and run the query for the next page
-            response = self.make_api_request(endpoint, current_page, self.headers)
-
-            # Append the results received to the prvious one and make the transformation to bytes object
-            results_dict2 = response.json()
-            results_dict.update(results_dict2[0])
-            # Joins the results from multiple api calls
+        # Gitlab API returns paginated results by default, so every page is fetched
+        response, results_files = self.get_tree(endpoint)
 
         self.metadata_url = response.url
 
@@ -85,9 +95,8 @@ class GitlabPipeline(base.BasePipeline):
             self.metadata_size = 0
 
         try:
-            response_for_clone = requests.get(
+            response_for_clone = self.session.get(
                 url=f"https://gitlab.cern.ch/api/v4/projects/{self.recid}/",
-                headers=self.headers,
             )
 
             project_results = response_for_clone.json()
@@ -106,18 +115,56 @@ class GitlabPipeline(base.BasePipeline):
             self.metadata_filename,
         )
 
+    def get_tree(self, endpoint):
+        """
+        Get every page of the (recursive) repository tree listing.
+        The number of pages is taken from the first response, so the other
+        pages are then fetched concurrently. When GitLab doesn't report it
+        (it omits the totals for very large listings), the `next` links are
+        followed instead.
+        Returns: (first response, list of the tree entries of all the pages)
+        """
+        response = self.make_api_request(endpoint, 1, self.headers)
+        results_files = response.json()
+
+        total_pages = response.headers.get("X-Total-Pages")
+        if total_pages:
+            pages = range(2, int(total_pages) + 1)
+            workers = max(1, min(int(self.download_workers), len(pages)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # map() keeps the pages in order
+                for page_response in executor.map(
+                    partial(self.make_api_request, endpoint, headers=self.headers),
+                    pages,
+                ):
+                    results_files.extend(page_response.json())
+        else:
+            next_page = response
+            while "next" in next_page.links:
+                next_page = self.make_api_request(
+                    next_page.links["next"]["url"], None, self.headers
+                )
+                results_files.extend(next_page.json())
+
+        log.debug(f"Got {len(results_files)} entries from the repository tree")
+        return response, results_files
+
     def make_api_request(self, endpoint, page, headers):
         """
         Make a (paginated) request to the GitLab api
+        (if page is None, the endpoint is a full page URL, e.g. from a Link header)
         Returns: response
         """
-        payload = {
-            "recursive": True,  # Enable recursive mode to look for files inside directories
-            "per_page": 50,  # Results per page
-            "page": page,  # Page to retrieve
-        }
+        if page is None:
+            payload = None
+        else:
+            payload = {
+                "recursive": True,  # Enable recursive mode to look for files inside directories
+                "per_page": TREE_PAGE_SIZE,  # Results per page
+                "page": page,  # Page to retrieve
+            }
         log.debug(f"Getting page {page} from {endpoint}")
-        r = requests.get(url=endpoint, params=payload, headers=headers)
+        r = self.session.get(url=endpoint, params=payload, headers=headers)
         if r.status_code in range(400, 404):
             raise APIException("You don't have access to that repository.")
         elif r.ok:
@@ -132,55 +179,48 @@ class GitlabPipeline(base.BasePipeline):
         log.info("Parsing file metadata..")
         files = []
 
-        with open(metadata_filename) as jsonFile:
-            metadataFile = json.load(jsonFile)
-            jsonFile.close()
-
-        # Parse results metadata file
-        for results in metadataFile["files"]:
-            if results["type"] == "blob":
-                file_object = {"origin": {}}
-                file_object["size"] = 0
-                if "name" in results:
-                    file_object["origin"]["filename"] = results["name"]
-                if "path" in results:
-                    path = results["path"]
-                    file_object["origin"]["path"] = path
-                    encoded_path = quote(path, safe="")
-                    download_url = f"{self.base_url}/api/v4/projects/{self.recid}/repository/files/{encoded_path}"
-                    file_object["origin"]["url"] = download_url
-                    file_object["bagpath"] = f"data/content/repository_files/{path}"
-                if "id" in results:
-                    file_object["origin"]["id"] = results["id"]
-
-                file_object["metadata"] = False
-                file_object["downloaded"] = False
-
-                files.append(file_object)
-
-        meta_file_entry = {
-            "origin": {
-                "filename": f"{ntpath.basename(metadata_filename)}",
-                "path": "",
-                "url": self.metadata_url,
-            },
-            "metadata": True,
-            "downloaded": True,
-            "bagpath": f"data/content/{ntpath.basename(metadata_filename)}",
-            "size": self.metadata_size,
-        }
+        # Parse results metadata file, reading the tree entries one at a time
+        with open(metadata_filename, "rb") as jsonFile:
+            for results in iter_items(jsonFile, "files.item"):
+                if results["type"] == "blob":
+                    file_object = FileEntry(origin=FileOrigin())
+                    file_object["size"] = 0
+                    if "name" in results:
+                        file_object["origin"]["filename"] = results["name"]
+                    if "path" in results:
+                        path = results["path"]
+                        file_object["origin"]["path"] = path
+                        encoded_path = quote(path, safe="")
+                        download_url = f"{self.base_url}/api/v4/projects/{self.recid}/repository/files/{encoded_path}"
+                        file_object["origin"]["url"] = download_url
+                        file_object["bagpath"] = f"data/content/repository_files/{path}"
+                    if "id" in results:
+                        file_object["origin"]["id"] = results["id"]
+
+                    file_object["metadata"] = False
+                    file_object["downloaded"] = False
+
+                    files.append(file_object)
+
+        meta_file_entry = FileEntry(
+            origin=FileOrigin(
+                filename=f"{ntpath.basename(metadata_filename)}",
+                path="",
+                url=self.metadata_url,
+            ),
+            metadata=True,
+            downloaded=True,
+            bagpath=f"data/content/{ntpath.basename(metadata_filename)}",
+            size=self.metadata_size,
+        )
         files.append(meta_file_entry)
 
-        # Fetch additional metadata package and append to the current values.
-        files = self.get_gitlab_exported_metadata(
-            self.recid, self.source, self.base_path, files, self.metadata_filename
-        )
+        # The files of the export package are added once it's ready
+        #  (see join_export)
 
         return files, meta_file_entry
 
-    def get_gitlab_exported_metadata(
-        self, recid, source, base_path, files, metadata_filename
-    ):
+    def start_export(self):
         """
         This function uses the export API call according to: https://docs.gitlab.com/ee/api/project_import_export.html#schedule-an-export
         To get the metadata the program has 3 steps:
@@ -189,82 +229,143 @@ class GitlabPipeline(base.BasePipeline):
         Step 2: Make a request to the backend to check if the package is ready using GET /projects/:id/export
         Step 3: Download the package from gitlab when ready using GET /projects/:id/export/download
 
-        This functions downloads and uncompresses the metadata package.
-
-        Finally appends the downloaded metadata to the existing ones
+        Step 1 is done here, steps 2 and 3 in a background thread (see wait_for_export),
+        so the rest of the job goes on in the meantime.
         """
         log.debug("Requesting export from upstream...")
 
-        r = requests.post(
-            f"https://gitlab.cern.ch/api/v4/projects/{recid}/export",
-            headers=self.headers,
+        r = self.session.post(
+            f"https://gitlab.cern.ch/api/v4/projects/{self.recid}/export",
         )
 
-        if r.ok:
-            """
-            Makes repetitve API requests till the exported package is available for download
-            """
-            results_fetched = False
-            time.sleep(1)  # Wait 1 second the first time for the results to be exported
-            while (
-                self.current_time_elapsed <= self.total_seconds_allowed
-                and results_fetched is False
-            ):  # If the time elapsed is less than the max allowed time, and if the results are not fetched continues the loop.
+        if not r.ok:
+            raise APIException(
+                "Request Failed. Check if you have access to export from this repository."
+            )
+
+        self.export = Future()
+        # Daemon thread, so a failed job doesn't wait for the export to exit
+        #  (jobs stop it with cancel_background_tasks)
+        self.export_thread = threading.Thread(
+            target=self.wait_for_export, args=(self.base_path, self.export), daemon=True
+        )
+        self.export_thread.start()
+
+    def wait_for_export(self, base_path, export):
+        """
+        Makes repeated API requests (waiting twice as long every time) till the
+        exported package is available for download, then downloads it.
+        The File objects of the package (or the error) are set on the export future.
+        """
+        try:
+            interval = self.interval_seconds
+            deadline = time.monotonic() + self.total_seconds_allowed
+            while True:
+                if self.export_cancelled.wait(interval):
+                    raise GitlabException("Export cancelled.")
                 """
                 Calls the check_export function which returns true if it manages to get the data from the Gitlab API
                 """
                 results_fetched, files_from_export = self.check_export(base_path)
-                if (
-                    results_fetched
-                ):  # If the response from check_export is True break the loop
+                if results_fetched:
                     break
-                else:  # Otherwise wait for xx seconds and try again
-                    time.sleep(self.interval_seconds)
-                    self.current_time_elapsed = (
-                        self.current_time_elapsed + self.interval_seconds
+                if time.monotonic() + interval > deadline:
+                    raise GitlabException(
+                        "Maximum requests to gitlab server reached. Please try again later."
                     )
-            if not results_fetched:
-                raise GitlabException(
-                    "Maximum requests to gitlab server reached. Please try again later."
-                )
-
+                interval = min(interval * 2, self.max_interval_seconds)
+        except Exception as e:
+            export.set_exception(e)
         else:
-            raise APIException(
-                "Request Failed. Check if you have access to export from this repository."
-            )
+            log.debug("Export package retrieved")
+            export.set_result(files_from_export)
 
-        log.debug("Export package retrieved")
-        for file_from_export in files_from_export:
-            """
-            For the files list returned from the local pipeline instance, change the
-            necessary values of that file and append to the original files list
-            """
-            # If it is the metadata json, do not add it to the files list as it already exists.
-            # (double checks both the name and the bagpath)
-            if not (
-                file_from_export["origin"]["filename"]
-                == ntpath.basename(self.metadata_filename)
-                and file_from_export["bagpath"]
-                == f"data/content/{ntpath.basename(self.metadata_filename)}"
-            ):
-                file_from_export["downloaded"] = True
-                file_from_export["metadata"] = True
-                file_from_export["origin"][
-                    "url"
-                ] = f"https://gitlab.cern.ch/api/v4/projects/{recid}/export"
-                if "sourcePath" in file_from_export["origin"]:
-                    origin = file_from_export["origin"]
-                    origin.pop("sourcePath")
-                if "rawstat" in file_from_export:
-                    file_from_export.pop("rawstat")
-                files.append(file_from_export)
+    def cancel_background_tasks(self):
+        """
+        Stop the export running in the background (e.g. when the job failed,
+        before its folder is deleted) and wait for it
+        """
+        self.export_cancelled.set()
+        if self.export_thread is not None:
+            self.export_thread.join()
+            self.export_thread = None
+        self.export = None
+
+    def check_cancelled(self):
+        if self.export_cancelled.is_set():
+            raise GitlabException("Export cancelled.")
+
+    def join_export(self, files):
+        """
+        Wait for the export started by start_export and append the files of the
+        package to the files list (in place).
+        """
+        if self.export is None:
+            return files
+
+        log.debug("Waiting for the export package...")
+        files_from_export = self.export.result()
+        self.export = None
+
+        return self.merge_files(
+            files,
+            files_from_export,
+            url=f"https://gitlab.cern.ch/api/v4/projects/{self.recid}/export",
+            metadata=True,
+        )
+
+    def merge_files(self, files, new_files, url, metadata):
+        """
+        Merge the File objects of files found on disk (e.g. from the clone or the
+        export package) into the files list (in place), matching them by bagpath
+        through an index, so it takes linear time even for huge repositories.
+        Files already listed (e.g. from the repository tree) are marked as
+        downloaded, the others are appended with the given upstream url.
+        """
+        index = {file["bagpath"]: file for file in files if "bagpath" in file}
+        for new_file in new_files:
+            existing = index.get(new_file["bagpath"])
+            if existing is not None:
+                existing["downloaded"] = True
+                existing["metadata"] = metadata
+                existing["origin"].pop("sourcePath", None)
+                continue
+            new_file["downloaded"] = True
+            new_file["metadata"] = metadata
+            new_file["origin"]["url"] = url
+            new_file["origin"].pop("sourcePath", None)
+            new_file.pop("rawstat", None)
+            files.append(new_file)
+            index[new_file["bagpath"]] = new_file
 
         return files
 
+    def scan_content(self, folder, base_path):
+        """
+        File objects for the files under the given folder of the bag content
+        (with bagpaths relative to the content folder), without scanning the
+        rest of the content
+        """
+        content_path = f"{base_path}/data/content"
+        local_instance = LocalV1Pipeline(folder)
+        files = []
+        for dirpath, entry in local_instance.scan_tree(folder.rstrip("/")):
+            files.append(
+                local_instance.get_local_metadata(
+                    entry.name, content_path, dirpath, None, isFile=False
+                )
+            )
+        return files
+
+    def create_fetch_txt(self, files, source, dest):
+        # The export package is downloaded anyway
+        self.join_export(files)
+        return super().create_fetch_txt(files, source, dest)
+
     def check_export(self, base_path):
         """
         Check if the requested export is ready and if it is, download and unpack it
-        The "local" pipeline is then executed on the downloaded file so they can be added to the manifest
+        (see extract_export)
         """
         log.debug("Checking for gitlab server response...")
 
@@ -272,10 +373,9 @@ class GitlabPipeline(base.BasePipeline):
 
         # sending get request and saving the response as response object
 
-        r2 = requests.get(url=URL, headers=self.headers)
+        r2 = self.session.get(url=URL)
 
         results = r2.json()
-        path = results["path"]
 
         if results["export_status"] == "finished":
             log.debug("Export package ready")
@@ -283,10 +383,9 @@ class GitlabPipeline(base.BasePipeline):
             URL = f"https://gitlab.cern.ch/api/v4/projects/{self.recid}/export/download"
             # sending get request and saving the response as response object
 
-            headers = self.headers
-            headers["Accept-encoding"] = "gzip, deflate, br"
+            headers = {"Accept-encoding": "gzip, deflate, br"}
 
-            r3 = requests.get(url=URL, stream=True, headers=headers)
+            r3 = self.session.get(url=URL, stream=True, headers=headers)
 
             if r3.ok:
                 exported_files_destination = (
@@ -299,37 +398,21 @@ class GitlabPipeline(base.BasePipeline):
                 The second one to add all the additional files that include metadata about issues, merge requests, ci pipelines etc.
                 """
 
+                # The job may have failed (and its folder been deleted) meanwhile
+                self.check_cancelled()
+
                 os.mkdir(
                     exported_files_destination
                 )  # additional metadata folder creation
 
                 try:
-                    compressed_filename = f"{path}.tar.gz"
-                    with open(compressed_filename, "wb") as f:
-                        for chunk in r3.raw.stream(1024, decode_content=False):
-                            if chunk:
-                                f.write(chunk)
-                    # uncompress downloaded file
-                    shutil.unpack_archive(
-                        compressed_filename, exported_files_destination
-                    )
-
-                    # delete the compressed file and keep the uncompressed SIP
-                    os.remove(compressed_filename)
-
-                    # Initialize a new local mode instance and run the scan_files function passing the uncompressed folder path
-                    local_instance = LocalV1Pipeline(exported_files_destination)
-
-                    files = local_instance.scan_files(
-                        f"{base_path}/data/content", author=None
-                    )
+                    # Extract the package while it's being downloaded
+                    files = self.extract_export(r3.raw, exported_files_destination)
 
                     # remove job and shut down the scheduler
                     return True, files
 
                 except Exception as e:
-                    if os.path.exists(compressed_filename):
-                        os.remove(compressed_filename)
                     raise Exception("Retrieving export package failed.", e)
             else:
                 log.info("Maximum requests to gitlab server reached. Trying again...")
@@ -338,6 +421,95 @@ class GitlabPipeline(base.BasePipeline):
             log.debug("Export package not ready yet. Trying again...")
             return False, None
 
+    def extract_export(self, stream, destination):
+        """
+        Decompress and extract the export package (a .tar.gz) from the given
+        stream into destination, member by member as the data arrives, without
+        saving the archive first. Every file is hashed while being written.
+        Returns the File objects of the extracted files.
+        """
+        files = []
+        content_path = os.path.dirname(destination)
+        relpath = os.path.relpath(destination, content_path)
+
+        with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            for member in tar:
+                self.check_cancelled()
+                name = os.path.normpath(member.name)
+                # Only regular files and folders, never outside of the destination
+                if name.startswith(("/", "..")) or not (
+                    member.isfile() or member.isdir()
+                ):
+                    log.warning(f"Skipping {member.name} from the export package")
+                    continue
+                target = f"{destination}/{name}"
+                if member.isdir():
+                    os.makedirs(target, exist_ok=True)
+                    continue
+
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                hasher = MultiHasher(self.algorithms)
+                source = tar.extractfile(member)
+                with open(target, "wb") as f:
+                    while True:
+                        self.check_cancelled()
+                        chunk = source.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        hasher.update(chunk)
+                os.utime(target, (member.mtime, member.mtime))
+
+                path = os.path.dirname(f"{relpath}/{name}")
+                file = FileEntry(
+                    origin=FileOrigin(filename=os.path.basename(name), path=path),
+                    bagpath=f"data/content/{relpath}/{name}",
+                    size=hasher.size,
+                    date=member.mtime,
+                    metadata=False,
+                    downloaded=True,
+                    checksum=[
+                        f"{alg}:{value}" for alg, value in hasher.hexdigests().items()
+                    ],
+                )
+                self.record_payload_size(file, hasher.size)
+                files.append(file)
+
+        log.debug(f"Extracted {len(files)} files from the export package")
+        return files
+
+    def clone_repository(self, url, destination, base_path):
+        """
+        Clone the repository at url into destination, according to the
+        pipeline `clone_mode` (see CLONE_MODES).
+        In "bundle" mode a mirror clone is made next to the bag content and
+        packed into a single `repository.bundle` file in destination.
+        """
+        options = CLONE_OPTIONS[self.clone_mode]
+        log.debug(f"Cloning the repository ({self.clone_mode} mode)")
+
+        if self.clone_mode != "bundle":
+            subprocess.run(["git", "clone", *options, url, destination], check=True)
+            return
+
+        mirror = f"{base_path}/repository.git"
+        try:
+            subprocess.run(["git", "clone", *options, url, mirror], check=True)
+            subprocess.run(
+                [
+                    "git",
+                    "-C",
+                    mirror,
+                    "bundle",
+                    "create",
+                    os.path.abspath(f"{destination}/repository.bundle"),
+                    "--all",
+                ],
+                check=True,
+            )
+        finally:
+            shutil.rmtree(mirror, ignore_errors=True)
+
     def download_files(self, files, base_path):
         """
         Gets gitlab files using git clone repository
@@ -345,8 +517,6 @@ class GitlabPipeline(base.BasePipeline):
         clone_destination = f"{base_path}/data/content/repository_files/"
         os.mkdir(clone_destination)  # Creates the raw files folder
 
-        log.debug("Cloning the repository")
-
         try:
             """
             git clone using https + auth token needs a request with the following format:
@@ -356,62 +526,31 @@ class GitlabPipeline(base.BasePipeline):
             git_clone_command = (
                 "https://oauth2:" + self.api_key + "@" + split_http_command[1]
             )
-            subprocess.call(["git", "clone", git_clone_command, clone_destination])
-
-            # Initialize a new local mode instance and run the scan_files function passing the uncompressed folder path
-            local_instance = LocalV1Pipeline(clone_destination)
+            self.clone_repository(git_clone_command, clone_destination, base_path)
 
-            files_from_clone = local_instance.scan_files(
-                f"{base_path}/data/content", author=None
-            )
+            # Prepare the File objects of the cloned files
+            files_from_clone = self.scan_content(clone_destination, base_path)
 
-        except Exception():
+        except subprocess.CalledProcessError:
             raise GitlabException("Error while cloning the gitlab repository.")
 
-        for file_from_clone in files_from_clone:
-            """
-            For the files list returned from the local pipeline instance, change the
-            necessary values of that file and append to the original files list
-            """
-            # If it is the metadata json, do not add it to the files list as it already exists.
-            # (double checks both the name and the bagpath)
-            if not (
-                file_from_clone["origin"]["filename"]
-                == ntpath.basename(self.metadata_filename)
-                and file_from_clone["bagpath"]
-                == f"data/content/{ntpath.basename(self.metadata_filename)}"
-            ):
-                # Checks if the file already exists in the files list
-                exists = False
-                for file_from_get_metadata in files:
-                    if file_from_get_metadata["bagpath"] == file_from_clone["bagpath"]:
-                        exists = True
-                        file_from_get_metadata["downloaded"] = True
-                        file_from_get_metadata["metadata"] = False
-                        if "sourcePath" in file_from_get_metadata["origin"]:
-                            origin = file_from_get_metadata["origin"]
-                            origin.pop("sourcePath")
-                # If it does not, it means it is a metadata file or a file from the .git folder and adds it to the  files list
-                if not exists:
-                    file_from_clone["metadata"] = False
-                    file_from_clone["downloaded"] = True
-                    file_from_clone["origin"]["url"] = self.url_to_repo
-                    if "sourcePath" in file_from_clone["origin"]:
-                        origin = file_from_clone["origin"]
-                        origin.pop("sourcePath")
-                    if "rawstat" in file_from_get_metadata:
-                        file_from_get_metadata.pop("rawstat")
-                    files.append(file_from_clone)
-
-        return files
+        if self.clone_mode == "bundle":
+            # The files of the tree are only in the bundle, not in the payload
+            repository_files = "data/content/repository_files/"
+            files = [
+                file
+                for file in files
+                if not file.get("bagpath", "").startswith(repository_files)
+            ]
+
+        # Files from the tree listing are marked as downloaded, the others
+        #  (e.g. from the .git folder) are added
+        files = self.merge_files(
+            files, files_from_clone, url=self.url_to_repo, metadata=False
+        )
 
-    def create_manifests(self, files, base_path):
-        algs = ["sha256"]
-        for alg in algs:
-            log.info(f"Generating manifest {alg}..")
-            content, files = self.generate_manifest(files, alg, base_path)
-            self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
+        # Add the files of the export package, which was prepared in the meantime
+        return self.join_export(files)
 
 
 class APIException(Exception):
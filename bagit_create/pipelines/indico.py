@@ -1,16 +1,21 @@
 import json
 import logging
 import ntpath
-import os
-
-import requests
+from functools import partial
 
+from ..entries import BagpathResolver, FileEntry, FileOrigin
+from ..jsonstream import iter_items
 from . import base
 
 log = logging.getLogger("bic-basic-logger")
 
+# Events requested per page when listing the events of a category
+CATEGORY_PAGE_SIZE = 50
+
 
 class IndicoV1Pipeline(base.BasePipeline):
+    algorithms = ["md5", "sha1"]
+
     def __init__(self, base_url, token=None):
         log.info(f"Indico v3 pipeline initialised.\nBase URL: {base_url}")
         self.base_url = base_url
@@ -23,6 +28,13 @@ class IndicoV1Pipeline(base.BasePipeline):
             log.info("No Indico API key set. Running as unauthenticated.")
             self.api_key = ""
 
+        # Authenticate every request with the API Key
+        self.headers = {"Authorization": "Bearer " + self.api_key}
+
+        # Metadata of the event already fetched (e.g. when harvesting a category),
+        #  as {"content": event, "url": upstream_url}
+        self.prefetched_metadata = None
+
     # get metadata according to indico api guidelines
     def get_metadata(self, record_id, source):
         """
@@ -30,9 +42,8 @@ class IndicoV1Pipeline(base.BasePipeline):
         Returns: [metadata_serialized, metadata_upstream_url, operation_status_code]
         """
 
-        # Prepare call Indico API
-        # Authenticate with API Key
-        headers = {"Authorization": "Bearer " + self.api_key}
+        if self.prefetched_metadata is not None:
+            return self.get_prefetched_metadata(record_id, source)
 
         # Indico API export base endpoint
         endpoint = f"{self.base_url}/export/event/{record_id}.json"
@@ -40,7 +51,7 @@ class IndicoV1Pipeline(base.BasePipeline):
         # Query params
         payload = {"detail": "contributions", "occ": "yes", "pretty": "yes"}
 
-        r = requests.get(endpoint, headers=headers, params=payload)
+        r = self.session.get(endpoint, params=payload)
 
         log.debug(f"Getting {r.url}")
 
@@ -68,12 +79,67 @@ class IndicoV1Pipeline(base.BasePipeline):
                 f"Wrong recid. The record {record_id} does not exist or you need to set an API token to access it."
             )
 
+    def get_prefetched_metadata(self, record_id, source):
+        """
+        Returns the metadata of the event set in `prefetched_metadata`, in the
+        same format of the event export
+        """
+        metadata = json.dumps(
+            {"count": 1, "results": [self.prefetched_metadata["content"]]},
+            indent=4,
+            ensure_ascii=False,
+        ).encode("utf-8")
+
+        self.metadata_url = self.prefetched_metadata["url"]
+        self.metadata_size = len(metadata)
+
+        metadata_filename = f"metadata-{source}-{record_id}.json"
+        return metadata, self.metadata_url, 200, metadata_filename
+
+    def get_category_events(self, category_id, start=None, end=None):
+        """
+        Get the metadata of every event of a category (and its subcategories),
+        optionally between the `start` and `end` dates (e.g. 2023-01-01, or
+        anything else understood by the Indico export API), with a request
+        every CATEGORY_PAGE_SIZE events.
+        Yields (event metadata, upstream URL of the page) couples.
+        """
+        endpoint = f"{self.base_url}/export/categ/{category_id}.json"
+        offset = 0
+        while True:
+            payload = {
+                "detail": "contributions",
+                "occ": "yes",
+                "order": "start",
+                "limit": CATEGORY_PAGE_SIZE,
+                "offset": offset,
+            }
+            if start:
+                payload["from"] = start
+            if end:
+                payload["to"] = end
+
+            r = self.session.get(endpoint, params=payload)
+            log.debug(f"Getting {r.url}")
+
+            if r.status_code != 200:
+                raise APIException(
+                    f"Category request gave HTTP {r.status_code}. Check the Indico API key."
+                )
+
+            events = r.json()["results"]
+            for event in events:
+                yield event, r.url
+
+            if len(events) < CATEGORY_PAGE_SIZE:
+                break
+            offset += len(events)
+
     # Download Remote Folders in the cwd
     def download_files(self, files, base_path):
         log.info(f"Downloading {len(files)} files to {base_path}..")
 
-        headers = {"Authorization": "Bearer " + self.api_key}
-
+        tasks = []
         for idx, sourcefile in enumerate(files):
             if sourcefile["metadata"] is False:
                 destination = f'{base_path}/{sourcefile["bagpath"]}'
@@ -83,20 +149,16 @@ class IndicoV1Pipeline(base.BasePipeline):
                     {sourcefile["origin"]["url"]}..'
                 )
 
-                files[idx]["downloaded"] = self.downloadRemoteFile(
-                    sourcefile["origin"]["url"], destination, headers
+                tasks.append(
+                    (
+                        idx,
+                        destination,
+                        partial(self.downloadRemoteFile, sourcefile["origin"]["url"]),
+                    )
                 )
             else:
                 log.debug("Skipped downloading..")
-        return files
-
-    def create_manifests(self, files, base_path):
-        algs = ["md5", "sha1"]
-        for alg in algs:
-            log.info(f"Generating manifest {alg}..")
-            content, files = self.generate_manifest(files, alg, base_path)
-            self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
+        return self.run_downloads(files, tasks)
 
     def parse_metadata(self, metadata_filename):
         """
@@ -104,61 +166,63 @@ class IndicoV1Pipeline(base.BasePipeline):
         """
         log.info("Parsing metadata..")
         files = []
-
-        with open(metadata_filename) as jsonFile:
-            metadataFile = json.load(jsonFile)
-            jsonFile.close()
-
-        for results in metadataFile["results"]:
-            for folders in results["folders"]:
-                # Check for attachments
-                for att in folders["attachments"]:
-                    # Gets the file_object and the file_id.
-                    file_object, file_id = self.get_data_from_json(att)
-                    if file_object:
-                        file_object = self.resolve_name_conflicts(
-                            file_object, files, file_id
-                        )
-                        if file_object["origin"]["filename"]:
-                            files.append(file_object)
-                        else:
-                            log.warning(
-                                "Skipped entry. No basename found (probably an URL?)"
-                            )
-
-            for contributions in results["contributions"]:
-                for folders in contributions["folders"]:
+        meta_bagpath = f"data/content/{ntpath.basename(metadata_filename)}"
+        # Bagpaths already given to the files (the metadata file included,
+        #  so no attachment can overwrite it)
+        bagpaths = BagpathResolver([{"bagpath": meta_bagpath}])
+
+        # Events are read one at a time
+        with open(metadata_filename, "rb") as jsonFile:
+            for results in iter_items(jsonFile, "results.item"):
+                for folders in results["folders"]:
+                    # Check for attachments
                     for att in folders["attachments"]:
+                        # Gets the file_object and the file_id.
                         file_object, file_id = self.get_data_from_json(att)
                         if file_object:
                             file_object = self.resolve_name_conflicts(
-                                file_object, files, file_id
+                                file_object, bagpaths, file_id
                             )
                             if file_object["origin"]["filename"]:
                                 files.append(file_object)
                             else:
                                 log.warning(
-                                    "Skipped entry. No basename found (probably an"
-                                    " URL?)"
+                                    "Skipped entry. No basename found (probably an URL?)"
                                 )
 
-            # add extra metadata
-            meta_file_entry = {
-                "origin": {
-                    "filename": f"{ntpath.basename(metadata_filename)}",
-                    "path": "",
-                    "url": self.metadata_url,
-                },
-                "metadata": True,
-                "downloaded": True,
-                "bagpath": f"data/content/{ntpath.basename(metadata_filename)}",
-                "size": self.metadata_size,
-            }
-            files.append(meta_file_entry)
+                for contributions in results["contributions"]:
+                    for folders in contributions["folders"]:
+                        for att in folders["attachments"]:
+                            file_object, file_id = self.get_data_from_json(att)
+                            if file_object:
+                                file_object = self.resolve_name_conflicts(
+                                    file_object, bagpaths, file_id
+                                )
+                                if file_object["origin"]["filename"]:
+                                    files.append(file_object)
+                                else:
+                                    log.warning(
+                                        "Skipped entry. No basename found (probably an"
+                                        " URL?)"
+                                    )
+
+                # add extra metadata
+                meta_file_entry = FileEntry(
+                    origin=FileOrigin(
+                        filename=f"{ntpath.basename(metadata_filename)}",
+                        path="",
+                        url=self.metadata_url,
+                    ),
+                    metadata=True,
+                    downloaded=True,
+                    bagpath=meta_bagpath,
+                    size=self.metadata_size,
+                )
+                files.append(meta_file_entry)
         return files, meta_file_entry
 
     def get_data_from_json(self, att):
-        file_object = {"origin": {}}
+        file_object = FileEntry(origin=FileOrigin())
 
         file_object["size"] = 0
 
@@ -190,44 +254,19 @@ class IndicoV1Pipeline(base.BasePipeline):
         file_object["downloaded"] = False
         return file_object, id
 
-    def resolve_name_conflicts(self, file_object, files, id):
+    def resolve_name_conflicts(self, file_object, bagpaths, id):
         """
         Finds if there are two files with the same name at the same folder.
         If this happens, it prefixes the file name with the file_id.
 
         ex. filename1.jpg data/content/filename1.jpg
             filename1.jpg data/content/{file_id}-filename1.jpg
-        """
-        bagpath = file_object["bagpath"]
-        bagpath = self.resolve_duplicate(files, bagpath, id)
-
-        file_object["bagpath"] = bagpath
-
-        return file_object
 
-    def resolve_duplicate(self, files, bagpath, id):
+        `bagpaths` is the BagpathResolver of the bagpaths already taken.
         """
-        For each new file_object checks in the files list if there is another entry with the same filename.
-        If there is, then appends the {file_id}- prefix
-        """
-        for file in files:
-            # For each bagpath check in the files object if there is another identical
-            if file["bagpath"] == bagpath:
-                # If there is split the filename and the file extention ans save them in file_name and file_extention accordingly
-                file_name, file_extension = os.path.splitext(bagpath)
-                # Get the filename of the given path and add the {id}- preffix.
-                try:
-                    file_base_path, file_name = (
-                        os.path.split(file_name)[0],
-                        os.path.split(file_name)[1],
-                    )
-                except Exception:
-                    file_base_path = None
-                bagpath = os.path.join(
-                    file_base_path, str(id) + "-" + file_name + file_extension
-                )
+        file_object["bagpath"] = bagpaths.resolve(file_object["bagpath"], id)
 
-        return bagpath
+        return file_object
 
 
 class RecidException(Exception):
@@ -1,18 +1,21 @@
 import logging
 import ntpath
 import re
+from functools import partial
 
 import cern_sso
-import requests
 from pymarc import marcxml
 
 from .. import bibdocfile, cds
+from ..entries import FileEntry, FileOrigin
 from . import base
 
 log = logging.getLogger("bic-basic-logger")
 
 
 class InvenioV1Pipeline(base.BasePipeline):
+    algorithms = ["md5"]
+
     def __init__(self, base_url, recid, cert_path=None, token=None, skipssl=False):
         log.info(f"Invenio v1 pipeline initialised.\nBase URL: {base_url}")
         self.base_url = base_url
@@ -47,17 +50,17 @@ class InvenioV1Pipeline(base.BasePipeline):
         output = bibdocfile.run(record_id, bd_ssh_host)
         files = bibdocfile.parse(output, record_id)
 
-        bibdocfile_entry = {
-            "origin": {
-                "filename": "bibdoc.txt",
-                "path": "",
-                "url": self.metadata_url,
-            },
-            "metadata": False,
-            "downloaded": True,
-            "bagpath": "data/meta/bibdoc.txt",
-            "size": 0,
-        }
+        bibdocfile_entry = FileEntry(
+            origin=FileOrigin(
+                filename="bibdoc.txt",
+                path="",
+                url=self.metadata_url,
+            ),
+            metadata=False,
+            downloaded=True,
+            bagpath="data/meta/bibdoc.txt",
+            size=0,
+        )
         files.append(bibdocfile_entry)
 
         return output, files
@@ -77,9 +80,7 @@ class InvenioV1Pipeline(base.BasePipeline):
 
         payload = {"of": of}
 
-        r = requests.get(
-            record_url, params=payload, cookies=self.cookies, verify=self.verifyssl
-        )
+        r = self.session.get(record_url, params=payload)
 
         log.debug(f"Getting {r.url}")
 
@@ -122,7 +123,7 @@ class InvenioV1Pipeline(base.BasePipeline):
         files = []
         for f in record.get_fields("856"):
             # Prepare the File object
-            obj = {"origin": {}}
+            obj = FileEntry(origin=FileOrigin())
 
             # Default size
             obj["size"] = 0
@@ -165,34 +166,27 @@ class InvenioV1Pipeline(base.BasePipeline):
                 log.warning(f'Skipped entry "{f}". No basename found (probably an URL?)')
         log.debug(f"Got {len(files)} files")
 
-        meta_file_entry = {
-            "origin": {
-                "filename": f"{ntpath.basename(metadata_filename)}",
-                "path": "",
-                "url": self.metadata_url,
-            },
-            "metadata": True,
-            "downloaded": True,
-            "bagpath": f"data/content/{ntpath.basename(metadata_filename)}",
-            "size": self.metadata_size,
-        }
+        meta_file_entry = FileEntry(
+            origin=FileOrigin(
+                filename=f"{ntpath.basename(metadata_filename)}",
+                path="",
+                url=self.metadata_url,
+            ),
+            metadata=True,
+            downloaded=True,
+            bagpath=f"data/content/{ntpath.basename(metadata_filename)}",
+            size=self.metadata_size,
+        )
         files.append(meta_file_entry)
 
         return files, meta_file_entry
 
-    def create_manifests(self, files, base_path):
-        algs = ["md5"]
-        for alg in algs:
-            log.info(f"Generating manifest {alg}..")
-            content, files = self.generate_manifest(files, alg, base_path)
-            self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
-
     def download_files(self, files, base_path):
         """
         Given a Files object, download files in the specified path
         """
         log.info(f"Downloading {len(files)} files to {base_path}..")
+        tasks = []
         for idx, sourcefile in enumerate(files):
             # We're looking for files not flagged as metadata and not downloaded yet
             if sourcefile["metadata"] is False and sourcefile["downloaded"] is False:
@@ -209,19 +203,30 @@ class InvenioV1Pipeline(base.BasePipeline):
                     f'Downloading {sourcefile["origin"]["filename"]} from {download_url}..'
                 )
 
-                downloaded = cds.downloadRemoteFile(
-                    download_url, destination, self.verifyssl
+                tasks.append(
+                    (
+                        idx,
+                        destination,
+                        partial(
+                            cds.downloadRemoteFile,
+                            download_url,
+                            verify=self.verifyssl,
+                            session=self.session,
+                        ),
+                    )
                 )
 
-                if downloaded:
-                    files[idx]["downloaded"] = downloaded
-                else:
-                    files[idx].pop("bagpath")
-
             else:
                 log.debug(
                     f'Skipped downloading of {sourcefile["origin"]["filename"]} from              '
                     f'       {sourcefile["origin"]["url"]}..'
                 )
 
+        files = self.run_downloads(files, tasks)
+
+        # Files that could not be downloaded won't be part of the payload
+        for idx, destination, fetch in tasks:
+            if not files[idx]["downloaded"]:
+                files[idx].pop("bagpath")
+
         return files
@@ -2,9 +2,9 @@ import configparser
 import json
 import logging
 import os
+from functools import partial
 
-import requests
-
+from ..entries import BagpathResolver, FileEntry, FileOrigin
 from . import base
 
 log = logging.getLogger("bic-basic-logger")
@@ -24,6 +24,8 @@ def get_dict_value(dct, keys):
 
 
 class InvenioV3Pipeline(base.BasePipeline):
+    algorithms = ["md5"]
+
     def __init__(self, source, token=None):
         # Set up atuh headers for requesting metadata
         self.headers = {
@@ -58,7 +60,7 @@ class InvenioV3Pipeline(base.BasePipeline):
             log.error("No such Invenio instance: " + source)
 
     def get_metadata(self, recid, source):
-        res = requests.get(self.base_endpoint + str(recid), headers=self.headers)
+        res = self.session.get(self.base_endpoint + str(recid))
 
         if res.status_code != 200:
             raise Exception(f"Metadata request gave HTTP {res.status_code}.")
@@ -69,22 +71,17 @@ class InvenioV3Pipeline(base.BasePipeline):
         self.metadata_size = len(res.content)
         return self.metadata, self.metadata_url, res.status_code, "metadata.json"
 
-    def create_manifests(self, files, base_path):
-        alg = "md5"
-        log.info(f"Generating manifest {alg}..")
-        content, files = self.generate_manifest(files, alg, base_path)
-        self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
-
     def parse_metadata(self, metadata_filename):
         log.debug("Parsing metadata..")
 
         files = self.get_fileslist()
         files_obj = []
+        # Bagpaths already given to the files
+        bagpaths = BagpathResolver()
 
         # Records with only metadata have the files key set to None
         if files:
-            for sourcefile in files:
+            for idx, sourcefile in enumerate(files):
                 filename = self.get_filename(sourcefile)
                 if self.has_file_baseuri():
                     file_uri = self.get_file_baseuri()
@@ -101,33 +98,38 @@ class InvenioV3Pipeline(base.BasePipeline):
                     bagpath_filename = filename.replace("/", "-")
                 else:
                     bagpath_filename = filename
+                # Different names can end up with the same bag path (e.g. "a/b"
+                #  and "a-b"), in that case the file id is prepended
+                bagpath = bagpaths.resolve(
+                    f"data/content/{bagpath_filename}", sourcefile.get("id", idx)
+                )
 
                 # Let's save all the details we have about the current file
                 # (and how we saved it in the bag)
-                file_obj = {
-                    "origin": {"url": url, "filename": filename, "path": ""},
-                    "downloaded": False,
-                    "metadata": False,
-                    "bagpath": f"data/content/{bagpath_filename}",
-                    "checksum": sourcefile["checksum"],
-                    "size": sourcefile["size"],
-                }
+                file_obj = FileEntry(
+                    origin=FileOrigin(url=url, filename=filename, path=""),
+                    downloaded=False,
+                    metadata=False,
+                    bagpath=bagpath,
+                    checksum=sourcefile["checksum"],
+                    size=sourcefile["size"],
+                )
 
                 files_obj.append(file_obj)
 
             log.debug(f"Got {len(files)} files")
 
-        meta_file_entry = {
-            "origin": {
-                "filename": "metadata.json",
-                "path": "",
-                "url": self.metadata_url,
-            },
-            "metadata": True,
-            "downloaded": True,
-            "bagpath": "data/content/metadata.json",
-            "size": self.metadata_size,
-        }
+        meta_file_entry = FileEntry(
+            origin=FileOrigin(
+                filename="metadata.json",
+                path="",
+                url=self.metadata_url,
+            ),
+            metadata=True,
+            downloaded=True,
+            bagpath="data/content/metadata.json",
+            size=self.metadata_size,
+        )
 
         files_obj.append(meta_file_entry)
 
@@ -138,7 +140,7 @@ class InvenioV3Pipeline(base.BasePipeline):
 
         if self.config.getboolean("files_separately", fallback=False):
             url = self.base_endpoint + str(self.recid) + "/files"
-            res = requests.get(url, headers=self.headers)
+            res = self.session.get(url)
 
             if res.status_code != 200:
                 raise Exception(f"File list request gave HTTP {res.status_code}.")
@@ -152,7 +154,8 @@ class InvenioV3Pipeline(base.BasePipeline):
 
     def download_files(self, files, base_path):
         log.info(f"Downloading {len(files)} files to {base_path}..")
-        for sourcefile in files:
+        tasks = []
+        for idx, sourcefile in enumerate(files):
             if sourcefile["metadata"] is False:
                 destination = f'{base_path}/{sourcefile["bagpath"]}'
 
@@ -160,10 +163,16 @@ class InvenioV3Pipeline(base.BasePipeline):
                     f'Downloading {sourcefile["origin"]["filename"]} from {sourcefile["origin"]["url"]}..'
                 )
 
-                sourcefile["downloaded"] = self.download_file(
-                    sourcefile["origin"]["url"],
-                    destination,
-                    {"Authorization": f"Bearer {self.token}"},
+                tasks.append(
+                    (
+                        idx,
+                        destination,
+                        partial(
+                            self.download_file,
+                            sourcefile["origin"]["url"],
+                            headers={"Authorization": f"Bearer {self.token}"},
+                        ),
+                    )
                 )
             else:
                 log.debug(
@@ -171,6 +180,8 @@ class InvenioV3Pipeline(base.BasePipeline):
                     {sourcefile["origin"]["url"]}..'
                 )
 
+        files = self.run_downloads(files, tasks)
+
         log.info("Finished downloading")
         return files
 
@@ -2,16 +2,22 @@ import hashlib
 import logging
 import ntpath
 import os
-import shutil
-from os import listdir, stat, walk
+from os import listdir, stat
 from pwd import getpwuid
 
+from ..entries import FileEntry, FileOrigin
+from ..fileops import link_file
 from . import base
 
 log = logging.getLogger("bic-basic-logger")
 
+# Fields of the stat result saved in the File objects ("rawstat")
+STAT_FIELDS = [k for k in dir(os.stat_result) if k.startswith("st_")]
+
 
 class LocalV1Pipeline(base.BasePipeline):
+    algorithms = ["md5", "sha1"]
+
     def __init__(self, src):
         log.info(f"Local v1 pipeline initialised.\nLocal source: {src}")
         self.src = src
@@ -19,57 +25,106 @@ class LocalV1Pipeline(base.BasePipeline):
     def scan_files(self, src, author):
         """
         Walks through the source folder and prepare the "files" object
+        (a list, as it's gone through several times while building the bag:
+        see `iter_files` to go through the files only once)
         """
 
         log.info("Scanning source folder..")
-        files = []
-        # Base name for the local source folder e.g. for /home/author/Pictures the base_name is Pictures
-        base_name = os.path.basename(os.path.normpath(src))
-        # The authorSourcePath is the path before Pictures e.g. for /home/author/Pictures is /home/author
-        authorSourcePath = src[: len(src) - len(base_name) - 1]
+        files = list(self.iter_files(src, author))
+        if not files and os.path.isdir(src) and not listdir(src):
+            raise Exception("Given directory is empty.")
+        return files
 
-        # If source_path is a file just get data from that file otherwise use the walk function
+    def iter_files(self, src, author):
+        """
+        Lazily yield a File object for every file of the source (a folder or
+        a single file), scanning every folder once with os.scandir and
+        getting the metadata of every file with a single stat.
+        The scanned subfolders are kept in `source_folders`.
+        """
+        self.source_folders = []
+        # If source_path is a file just get data from that file
         if os.path.isfile(src):
             file = ntpath.basename(src)
             dirpath = ntpath.dirname(src)
-            obj = self.get_local_metadata(file, src, dirpath, isFile=True)
-            files.append(obj)
-        elif len(listdir(src)) == 0:
-            raise Exception("Given directory is empty.")
-        else:
-            # Walk through the whole directory and prepare an object for each found file
-            for dirpath, dirnames, filenames in walk(src, followlinks=True):
-                for file in filenames:
-                    obj = self.get_local_metadata(
-                        file,
-                        src,
-                        dirpath,
-                        author,
-                        isFile=False,
-                    )
-                    files.append(obj)
-        return files
-
-    def copy_files(self, files, source_dir, dest_dir):
-        if os.path.isfile(source_dir):
-            shutil.copy(
-                f"{source_dir}",
-                f"{dest_dir}/{ntpath.basename(source_dir)}",
+            yield self.get_local_metadata(file, src, dirpath, author, isFile=True)
+            return
+
+        for dirpath, entry in self.scan_tree(src, self.source_folders):
+            try:
+                # Follows symlinks, like the os.walk(followlinks=True) before
+                file_stat = entry.stat()
+            except OSError:
+                file_stat = None
+            yield self.get_local_metadata(
+                entry.name,
+                src,
+                dirpath,
+                author,
+                isFile=False,
+                file_stat=file_stat,
             )
-        else:
-            for dirpath, dirnames, filenames in walk(source_dir, followlinks=True):
-                if source_dir == dirpath:
-                    target = dest_dir
-                else:
-                    dest_relpath = dirpath[len(source_dir) + 1 :]
-                    target = f"{dest_dir}/{dest_relpath}"
-                    os.mkdir(target)
 
-                for file in filenames:
-                    shutil.copy(f"{os.path.abspath(dirpath)}/{file}", target)
+    def scan_tree(self, src, scanned=None):
+        """
+        Yield a (dirpath, DirEntry) couple for every file under src,
+        top-down as os.walk(followlinks=True) would, but without listing
+        folders twice or stat-ing files just to tell them from folders.
+        The path of every subfolder is appended to `scanned`, if given.
+        """
+        folders = [src]
+        while folders:
+            dirpath = folders.pop()
+            subfolders = []
+            try:
+                with os.scandir(dirpath) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        if is_dir:
+                            subfolders.append(entry.path)
+                            if scanned is not None:
+                                scanned.append(entry.path)
+                        else:
+                            yield dirpath, entry
+            except OSError as e:
+                log.warning(f"Unable to scan {dirpath}: {e}")
+            # Visit subfolders in the order they were listed
+            folders.extend(reversed(subfolders))
 
+    def copy_files(self, files, source_dir, dest_dir):
+        """
+        Bring the source files into the bag, according to the pipeline
+        `link_mode` (plain copies by default, see fileops.LINK_MODES).
+        Files are taken from the scanned File objects, without walking
+        the source again.
+        """
+        log.info(f"Copying files to the bag ({self.link_mode} mode)..")
+        methods = {}
+        created = set()
+        # Every scanned folder, empty ones included
+        for folder in getattr(self, "source_folders", []):
+            target = f"{dest_dir}/{os.path.relpath(folder, source_dir)}"
+            os.makedirs(target, exist_ok=True)
+            created.add(target)
         for file in files:
+            relpath = file["bagpath"][len("data/content/") :]
+            target = os.path.dirname(f"{dest_dir}/{relpath}")
+            if target not in created:
+                os.makedirs(target, exist_ok=True)
+                created.add(target)
+
+            method = link_file(
+                file["origin"]["sourcePath"], f"{dest_dir}/{relpath}", self.link_mode
+            )
+            methods[method] = methods.get(method, 0) + 1
+
             file["downloaded"] = True
+            self.record_payload_size(file, file.get("size"))
+        log.debug(f"Files brought into the bag by method: {methods}")
+
         return files
 
     # needed in case we use the folder name
@@ -96,17 +151,13 @@ class LocalV1Pipeline(base.BasePipeline):
             lc_src = os.path.abspath(src)
             return lc_src
 
-    def create_manifests(self, files, base_path):
-        algs = ["md5", "sha1"]
-        for alg in algs:
-            log.info(f"Generating manifest {alg}..")
-            content, files = self.generate_manifest(files, alg, base_path)
-            self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
-
-    def get_local_metadata(self, file, src, dirpath, author, isFile):
+    def get_local_metadata(self, file, src, dirpath, author, isFile, file_stat=None):
+        """
+        Prepare the File object for the given file. Size, date and raw stat are
+        taken from `file_stat` if given, otherwise the file is stat-ed (once).
+        """
         # Prepare the File object
-        obj = {"origin": {}}
+        obj = FileEntry(origin=FileOrigin())
 
         obj["origin"]["filename"] = file
         # If you are in the root directory just use filename
@@ -123,20 +174,16 @@ class LocalV1Pipeline(base.BasePipeline):
 
         obj["bagpath"] = f"data/content/{sourcePath}"
 
-        try:
-            file_stat = os.stat(f"{dirpath}/{file}")
+        if file_stat is None:
+            try:
+                file_stat = os.stat(f"{dirpath}/{file}")
+            except OSError:
+                log.debug("Unable to stat file. Skipping.")
+
+        if file_stat is not None:
             obj["rawstat"] = self.stat_to_json(file_stat)
-        except Exception:
-            log.debug("Unable to stat file. Skipping.")
-
-        try:
-            obj["size"] = os.path.getsize(f"{dirpath}/{file}")
-        except OSError:
-            log.debug(" Size cannot be found. Skipping field. ")
-        try:
-            obj["date"] = os.path.getmtime(f"{dirpath}/{file}")
-        except OSError:
-            log.debug(" Date cannot be found. Skipping field. ")
+            obj["size"] = file_stat.st_size
+            obj["date"] = file_stat.st_mtime
         if author:
             obj["creator"] = author
 
@@ -146,6 +193,4 @@ class LocalV1Pipeline(base.BasePipeline):
         return obj
 
     def stat_to_json(self, stat_output):
-        return {
-            k: getattr(stat_output, k) for k in dir(stat_output) if k.startswith("st_")
-        }
+        return {k: getattr(stat_output, k) for k in STAT_FIELDS}
@@ -1,15 +1,18 @@
-import json
 import logging
+from functools import partial
 
-import requests
 from cernopendata_client import searcher
 
+from ..entries import FileEntry, FileOrigin
+from ..jsonstream import get_value, iter_items
 from . import base
 
 log = logging.getLogger("bic-basic-logger")
 
 
 class OpenDataPipeline(base.BasePipeline):
+    algorithms = ["adler32"]
+
     def __init__(self, base_url):
         log.info(f"CERN Open Data pipeline initialised.\nBase URL: {base_url}")
         self.SERVER_HTTP_URI = base_url
@@ -30,75 +33,88 @@ class OpenDataPipeline(base.BasePipeline):
     def parse_metadata(self, metadata_file_path):
         log.info("Parsing metadata..")
         files = []
-        with open(metadata_file_path) as jsonFile:
-            metadata = json.load(jsonFile)
-            jsonFile.close()
+        with open(metadata_file_path, "rb") as jsonFile:
+            record_id = get_value(jsonFile, "id")
 
-        for sourcefile in metadata["metadata"]["files"]:
-            # file lists are TXT and JSON, look for the JSON ones
-            if "type" in sourcefile:
-                if sourcefile["key"][-4:] == "json" and "index" in sourcefile["type"]:
-                    list_endpoint = f"https://opendata.cern.ch/record/{metadata['id']}/files/{sourcefile['key']}"
-                    # Download the file list
-                    r = requests.get(list_endpoint)
-                    log.debug(f"Unpacking file list {list_endpoint}")
-                    # For every file in the list
-                    for el in r.json():
-                        # Remove the EOS instance prefix to get the path
-                        el["url"] = el["uri"].replace(
-                            "root://eospublic.cern.ch/", "http://opendata.cern.ch/"
+        # Files (and the entries of the file indexes) are read one at a time
+        with open(metadata_file_path, "rb") as jsonFile:
+            for sourcefile in iter_items(jsonFile, "metadata.files.item"):
+                # file lists are TXT and JSON, look for the JSON ones
+                if "type" in sourcefile:
+                    if (
+                        sourcefile["key"][-4:] == "json"
+                        and "index" in sourcefile["type"]
+                    ):
+                        list_endpoint = (
+                            f"https://opendata.cern.ch/record/{record_id}/files/"
+                            f"{sourcefile['key']}"
                         )
-                        # Append the final path
-                        el["path"] = el["filename"]
-                        localpath = el["path"]
-                        el["bagpath"] = f"data/content/{localpath}"
-                        el["metadata"] = False
-                        el["downloaded"] = False
-                        if type not in el or (type in el and el["type"] != "index.txt"):
-                            # Map values to build a "File" entry
-                            file = {
-                                "origin": {
-                                    # Save both HTTP and ROOT URLs
-                                    "url": [el["url"], el["uri"]],
-                                    "filename": el["filename"],
-                                    "path": "",
-                                },
-                                "size": el["size"],
-                                "bagpath": f"data/content/{localpath}",
-                                "metadata": False,
-                                "downloaded": False,
-                            }
-                            files.append(file)
-            else:
-                sourcefile["url"] = sourcefile["uri"].replace(
-                    "root://eospublic.cern.ch/", "http://opendata.cern.ch/"
-                )
-                sourcefile["filename"] = sourcefile["key"]
-                sourcefile["path"] = sourcefile["filename"]
-                localpath = sourcefile["path"]
-                sourcefile["downloaded"] = False
-                # Map values to build a "File" entry
-                file = {
-                    "origin": {
-                        # Save both HTTP and ROOT URLs
-                        "url": [sourcefile["url"], sourcefile["uri"]],
-                        "filename": sourcefile["key"],
-                        "path": "",
-                    },
-                    "size": sourcefile["size"],
-                    "bagpath": f"data/content/{localpath}",
-                    "metadata": False,
-                    "downloaded": False,
-                }
-                files.append(file)
+                        # Download the file list, parsing it while it arrives
+                        with self.session.get(list_endpoint, stream=True) as r:
+                            r.raise_for_status()
+                            r.raw.decode_content = True
+                            log.debug(f"Unpacking file list {list_endpoint}")
+                            # For every file in the list
+                            for el in iter_items(r.raw, "item"):
+                                # Remove the EOS instance prefix to get the path
+                                el["url"] = el["uri"].replace(
+                                    "root://eospublic.cern.ch/",
+                                    "http://opendata.cern.ch/",
+                                )
+                                # Append the final path
+                                el["path"] = el["filename"]
+                                localpath = el["path"]
+                                el["bagpath"] = f"data/content/{localpath}"
+                                el["metadata"] = False
+                                el["downloaded"] = False
+                                if type not in el or (
+                                    type in el and el["type"] != "index.txt"
+                                ):
+                                    # Map values to build a "File" entry
+                                    file = FileEntry(
+                                        origin=FileOrigin(
+                                            # Save both HTTP and ROOT URLs
+                                            url=[el["url"], el["uri"]],
+                                            filename=el["filename"],
+                                            path="",
+                                        ),
+                                        size=el["size"],
+                                        bagpath=f"data/content/{localpath}",
+                                        metadata=False,
+                                        downloaded=False,
+                                    )
+                                    files.append(file)
+                else:
+                    sourcefile["url"] = sourcefile["uri"].replace(
+                        "root://eospublic.cern.ch/", "http://opendata.cern.ch/"
+                    )
+                    sourcefile["filename"] = sourcefile["key"]
+                    sourcefile["path"] = sourcefile["filename"]
+                    localpath = sourcefile["path"]
+                    sourcefile["downloaded"] = False
+                    # Map values to build a "File" entry
+                    file = FileEntry(
+                        origin=FileOrigin(
+                            # Save both HTTP and ROOT URLs
+                            url=[sourcefile["url"], sourcefile["uri"]],
+                            filename=sourcefile["key"],
+                            path="",
+                        ),
+                        size=sourcefile["size"],
+                        bagpath=f"data/content/{localpath}",
+                        metadata=False,
+                        downloaded=False,
+                    )
+                    files.append(file)
         return files, {}
 
     def download_files(self, files, temp_files_path):
         log.info(f"Downloading {len(files)} files to {temp_files_path}..")
-        skipped = 0
-        for file in files:
+        tasks = []
+        eos_tasks = []
+        for idx, file in enumerate(files):
             if file["metadata"] is False:
-                destination = f'{temp_files_path}/{file["origin"]["filename"]}'
+                destination = f'{temp_files_path}/{file["bagpath"]}'
                 # If more than one URL is available, use the first one (HTTP)
                 if type(file["origin"]["url"]) == list:
                     download_url = file["origin"]["url"][0]
@@ -108,18 +124,21 @@ class OpenDataPipeline(base.BasePipeline):
                     f'Downloading {file["origin"]["filename"]} from {download_url}..'
                 )
                 if download_url[:4] == "http":
-                    file["downloaded"] = self.downloadRemoteFile(
-                        download_url,
-                        destination,
+                    tasks.append(
+                        (
+                            idx,
+                            destination,
+                            partial(self.downloadRemoteFile, download_url),
+                        )
                     )
                 elif download_url[:4] == "/eos":
-                    file["downloaded"] = self.downloadEOSfile(
-                        download_url,
-                        destination,
+                    eos_tasks.append(
+                        (idx, destination, partial(self.downloadEOSfile, download_url))
                     )
 
-                    if file["downloaded"] is False:
-                        skipped += 1
+        files = self.run_downloads(files, tasks + eos_tasks)
+
+        skipped = sum(1 for idx, _, _ in eos_tasks if files[idx]["downloaded"] is False)
         if skipped > 0:
             log.info(
                 f"{skipped} files were skipped. Checksums will be searched in metadata \
@@ -128,13 +147,7 @@ class OpenDataPipeline(base.BasePipeline):
         return files
 
     def create_manifests(self, files, base_path):
-        algs = ["adler32"]
         log.warning(
             "adler32 was selected because it's the only checksum available in CERN Open Data. This will create an invalid Bag, as adler32 is not supported."
         )
-
-        for alg in algs:
-            log.info(f"Generating manifest {alg}..")
-            content, files = self.generate_manifest(files, alg, base_path)
-            self.write_file(content, f"{base_path}/manifest-{alg}.txt")
-        return files
+        return super().create_manifests(files, base_path)
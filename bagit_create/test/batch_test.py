@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from .. import batch
+from ..pipelines import indico
+from ..pipelines.base import WrongInputException
+
+
+def test_read_jobs():
+    with tempfile.NamedTemporaryFile("w+t") as f:
+        f.write("# Some records\ncds 2728246\n\nhttps://zenodo.org/record/3911261\n")
+        f.flush()
+        jobs = batch.read_jobs(f.name)
+
+    assert jobs == [
+        {"source": "cds", "recid": "2728246"},
+        {"url": "https://zenodo.org/record/3911261"},
+    ]
+
+
+def test_process_many():
+    with tempfile.TemporaryDirectory() as src1:
+        with tempfile.TemporaryDirectory() as src2:
+            with tempfile.TemporaryDirectory() as target:
+                for src in [src1, src2]:
+                    with open(f"{src}/file.txt", "w") as f:
+                        f.write(src)
+
+                jobs = [
+                    {"source": "local", "source_path": src1, "author": "python-test"},
+                    {"source": "local", "source_path": src2, "author": "python-test"},
+                    # Wrong input, will fail
+                    {"source": "local", "source_path": src1},
+                ]
+                report = batch.process_many(
+                    jobs, workers=2, retries=1, retry_delay=0, target=target
+                )
+
+                created = sorted(os.listdir(target))
+                # Every bag has the log of its own job only
+                logs = [
+                    open(
+                        f"{target}/{result['foldername']}/data/meta/bagitcreate.log"
+                    ).read()
+                    for result in report["results"][:2]
+                ]
+
+    assert [result["status"] for result in report["results"]] == [0, 0, 1]
+    assert report["results"][2]["attempts"] == 2
+    assert report["summary"]["successful"] == 2
+    assert report["summary"]["failed"] == 1
+    assert created == sorted(result["foldername"] for result in report["results"][:2])
+    assert f"Local source: {src1}" in logs[0] and src2 not in logs[0]
+    assert f"Local source: {src2}" in logs[1] and src1 not in logs[1]
+
+
+class FakeSession:
+    def __init__(self, events):
+        self.events = events
+        self.requests = []
+        self.closed = 0
+
+    def get(self, url, params):
+        self.requests.append(params)
+        page = self.events[params["offset"] : params["offset"] + params["limit"]]
+        return FakeResponse(f"{url}?offset={params['offset']}", {"results": page})
+
+    def reset(self):
+        self.closed += 1
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, url, content):
+        self.url = url
+        self.content = content
+
+    def json(self):
+        return self.content
+
+
+def test_harvest_indico_category(monkeypatch):
+    events = [{"id": i, "folders": [], "contributions": []} for i in range(120)]
+    session = FakeSession(events)
+    monkeypatch.setattr(indico.IndicoV1Pipeline, "http_session", session)
+    monkeypatch.setattr(
+        batch, "process_many", lambda jobs, **kwargs: {"jobs": jobs, **kwargs}
+    )
+
+    report = batch.harvest_indico_category("72", start="2023-01-01", workers=3)
+
+    # A request every CATEGORY_PAGE_SIZE events
+    assert [params["offset"] for params in session.requests] == [0, 50, 100]
+    assert session.requests[0]["from"] == "2023-01-01"
+    # One job for each event, carrying its metadata
+    jobs = report["jobs"]
+    assert [job["recid"] for job in jobs] == list(range(120))
+    assert jobs[60]["prefetched_metadata"]["content"] is events[60]
+    assert jobs[60]["prefetched_metadata"]["url"].endswith("72.json?offset=50")
+    assert report["workers"] == 3
+    assert {job["source"] for job in jobs} == {"indico"}
+    # The session of the listing is released
+    assert session.closed == 1
+
+
+def test_harvest_other_indico_instance(monkeypatch):
+    session = FakeSession([{"id": 1, "folders": [], "contributions": []}])
+    monkeypatch.setattr(indico.IndicoV1Pipeline, "http_session", session)
+    monkeypatch.setattr(
+        batch, "process_many", lambda jobs, **kwargs: {"jobs": jobs, **kwargs}
+    )
+
+    report = batch.harvest_indico_category("5", source="ilcagenda")
+
+    # The events are SIPs of the ilcagenda source
+    job = report["jobs"][0]
+    assert job["source"] == "ilcagenda"
+    assert job["prefetched_metadata"]["url"].startswith(
+        "https://agenda.linearcollider.org/"
+    )
+    with pytest.raises(WrongInputException):
+        batch.harvest_indico_category("5", source="zenodo")
+
+
+def test_indico_prefetched_metadata():
+    pipeline = indico.IndicoV1Pipeline("https://indico.example.org/")
+    pipeline.prefetched_metadata = {"content": {"id": 7}, "url": "https://upstream"}
+
+    metadata, url, status_code, filename = pipeline.get_metadata(7, "indico")
+
+    assert json.loads(metadata) == {"count": 1, "results": [{"id": 7}]}
+    assert url == "https://upstream"
+    assert filename == "metadata-indico-7.json"
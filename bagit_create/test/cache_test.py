@@ -0,0 +1,159 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from .. import cache
+from ..pipelines import base
+
+
+def test_parse_size():
+    assert cache.parse_size(1024) == 1024
+    assert cache.parse_size("500M") == 500 * 1024**2
+    assert cache.parse_size("1.5GiB") == int(1.5 * 1024**3)
+
+
+def test_cached_downloads():
+    md5 = hashlib.md5(b"payload").hexdigest()
+    sha1 = hashlib.sha1(b"payload").hexdigest()
+
+    fetched = []
+
+    def fetch(dest, hasher):
+        fetched.append(dest)
+        with open(dest, "wb") as f:
+            f.write(b"payload")
+        hasher.update(b"payload")
+        return True
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        payload_cache = cache.PayloadCache(f"{tmpdir}/cache")
+        for run in range(2):
+            pipeline = base.BasePipeline()
+            pipeline.algorithms = ["md5", "sha1"]
+            pipeline.cache = payload_cache
+            os.mkdir(f"{tmpdir}/{run}")
+
+            files = [{"downloaded": False, "checksum": f"md5:{md5}", "size": 7}]
+            files = pipeline.run_downloads(files, [(0, f"{tmpdir}/{run}/file", fetch)])
+
+            assert files[0]["checksum"] == [f"md5:{md5}", f"sha1:{sha1}"]
+            assert open(f"{tmpdir}/{run}/file", "rb").read() == b"payload"
+
+        # The second run took the file from the cache
+        assert fetched == [f"{tmpdir}/0/file"]
+
+
+def test_cached_file_rewritten():
+    md5 = hashlib.md5(b"payload").hexdigest()
+
+    def fetch(content):
+        def write(dest, hasher):
+            # Written in place, like most fetchers do
+            with open(dest, "wb") as f:
+                f.write(content)
+            hasher.update(content)
+            return True
+
+        return write
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        payload_cache = cache.PayloadCache(f"{tmpdir}/cache")
+        pipeline = base.BasePipeline()
+        pipeline.algorithms = ["md5"]
+        pipeline.cache = payload_cache
+        dest = f"{tmpdir}/file"
+
+        files = [{"downloaded": False, "checksum": f"md5:{md5}"}]
+        pipeline.run_downloads(files, [(0, dest, fetch(b"payload"))])
+
+        # The same destination gets a new version of the file (without an
+        #  upstream checksum, so it's not looked up in the cache)
+        files = [{"downloaded": False}]
+        pipeline.run_downloads(files, [(0, dest, fetch(b"new version"))])
+
+        assert open(dest, "rb").read() == b"new version"
+        path, entry = payload_cache.lookup({"md5": md5})
+        assert open(path, "rb").read() == b"payload"
+
+
+def test_cache_eviction():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        payload_cache = cache.PayloadCache(f"{tmpdir}/cache", max_size=25)
+        for idx in range(3):
+            src = f"{tmpdir}/{idx}"
+            with open(src, "wb") as f:
+                f.write(b"%d" % idx * 10)
+            checksums = {"md5": f"{idx}" * 32, "sha1": f"{idx}" * 40}
+            payload_cache.store(src, checksums)
+            # Make sure every file gets a different usage time
+            stamp = time.time() - 100 + idx
+            for alg, digest in checksums.items():
+                entry = f"{payload_cache.key_path(alg, digest)}.json"
+                os.utime(entry, (stamp, stamp))
+
+        # Use the oldest one again, so the second one is evicted instead
+        assert payload_cache.lookup({"md5": "0" * 32}) is not None
+        assert payload_cache.evict() == 1
+
+        assert payload_cache.lookup({"md5": "0" * 32}) is not None
+        assert payload_cache.lookup({"sha1": "1" * 40}) is None
+        assert payload_cache.lookup({"md5": "2" * 32}) is not None
+
+
+def test_cache_size(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        payload_cache = cache.PayloadCache(f"{tmpdir}/cache", max_size=25)
+        src = f"{tmpdir}/file"
+        with open(src, "wb") as f:
+            f.write(b"0" * 10)
+        # Stored twice, taking space once
+        for _ in range(2):
+            payload_cache.store(src, {"md5": "0" * 32, "sha1": "0" * 40})
+        assert payload_cache.update_size() == 10
+
+        # Under the maximum size, the cache is not scanned
+        def walk(path):
+            raise AssertionError("The cache was scanned")
+
+        monkeypatch.setattr(cache.os, "walk", walk)
+        assert payload_cache.evict() == 0
+
+
+def test_cached_file_evicted():
+    md5 = hashlib.md5(b"payload").hexdigest()
+    fetched = []
+
+    def fetch(dest, hasher):
+        fetched.append(dest)
+        with open(dest, "wb") as f:
+            f.write(b"payload")
+        hasher.update(b"payload")
+        return True
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        payload_cache = cache.PayloadCache(f"{tmpdir}/cache")
+        src = f"{tmpdir}/src"
+        with open(src, "wb") as f:
+            f.write(b"payload")
+        payload_cache.store(src, {"md5": md5})
+
+        lookup = payload_cache.lookup
+
+        def lookup_and_evict(checksums, size=None):
+            # Another job evicts the file right after it was found
+            found = lookup(checksums, size)
+            os.remove(found[0])
+            return found
+
+        payload_cache.lookup = lookup_and_evict
+        pipeline = base.BasePipeline()
+        pipeline.cache = payload_cache
+
+        files = [{"downloaded": False, "checksum": f"md5:{md5}"}]
+        files = pipeline.run_downloads(files, [(0, f"{tmpdir}/file", fetch)])
+
+        # Downloaded instead
+        assert fetched == [f"{tmpdir}/file"]
+        assert files[0]["downloaded"] is True
+        assert open(f"{tmpdir}/file", "rb").read() == b"payload"
@@ -0,0 +1,129 @@
+import json
+import os
+import tempfile
+
+from ..entries import BagpathResolver, FileEntry, FileOrigin, serialize
+from ..pipelines import local
+from ..version import complete_version
+
+
+def test_file_entry_access():
+    file = FileEntry(origin={"filename": "a.txt", "path": ""}, bagpath="data/a.txt")
+
+    assert isinstance(file["origin"], FileOrigin)
+    assert file["origin"]["filename"] == "a.txt"
+    assert "checksum" not in file
+    assert file.get("checksum") is None
+
+    file["checksum"] = ["md5:abc"]
+    file["origin"]["title"] = "A"
+    # Keys not known by the record are still accepted
+    file["note"] = "extra"
+
+    assert "checksum" in file
+    assert file["note"] == "extra"
+    assert list(file) == ["origin", "bagpath", "checksum", "note"]
+    assert file == {
+        "origin": {"filename": "a.txt", "path": "", "title": "A"},
+        "bagpath": "data/a.txt",
+        "checksum": ["md5:abc"],
+        "note": "extra",
+    }
+
+    del file["note"]
+    assert "note" not in file
+    assert file.pop("checksum") == ["md5:abc"]
+    assert file.pop("checksum", None) is None
+
+
+def test_file_entry_serialize():
+    file = FileEntry(
+        metadata=False,
+        origin=FileOrigin(url="", filename="a.txt", path=""),
+        rawstat={"st_size": 1},
+    )
+    file["checksum"] = ["md5:abc"]
+    file["metadata"] = True
+
+    data = json.dumps([file], default=serialize)
+
+    # Keys in the order they were first set, the origin always first
+    assert data == json.dumps(
+        [
+            {
+                "origin": {"url": "", "filename": "a.txt", "path": ""},
+                "metadata": True,
+                "rawstat": {"st_size": 1},
+                "checksum": ["md5:abc"],
+            }
+        ]
+    )
+
+
+def test_dump_json():
+    # sip.json of a small local bag, as written by the code building plain
+    #  dictionaries (before File objects were records)
+    fixture = os.path.join(os.path.dirname(__file__), "files/local_sip.json")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        source = f"{tmpdir}/source"
+        for path, data in [
+            ("a.txt", "a"),
+            ("sub/fìle.txt", "ü" * 10),
+            ("sub/deep/c.bin", ""),
+        ]:
+            os.makedirs(os.path.dirname(f"{source}/{path}"), exist_ok=True)
+            with open(f"{source}/{path}", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.utime(f"{source}/{path}", (1600000000, 1600000000))
+        bag = f"{tmpdir}/bag"
+        os.makedirs(f"{bag}/data/content")
+        os.makedirs(f"{bag}/data/meta")
+
+        pipeline = local.LocalV1Pipeline(source)
+        files = sorted(pipeline.scan_files(source, "author"), key=lambda f: f["bagpath"])
+        for file in files:
+            # The rest of the stat result can't be reproduced
+            file["rawstat"] = {"st_mtime": 1600000000.0, "st_size": file["size"]}
+        files = pipeline.copy_files(files, source, f"{bag}/data/content")
+        files = pipeline.create_manifests(files, bag)
+        params = {
+            "source": "local",
+            "recid": "1",
+            "source_path": "/source",
+            "source_base_path": "/",
+            "author": "author",
+        }
+        audit = [
+            {
+                "tool": {
+                    "name": "CERN BagIt Create",
+                    "version": complete_version,
+                    "params": params,
+                },
+                "action": "sip_create",
+                "timestamp": 1600000000,
+                "message": "",
+            }
+        ]
+        pipeline.create_sip_meta(files, audit, 1600000000, bag)
+
+        with open(f"{bag}/data/meta/sip.json", encoding="utf-8") as f:
+            written = f.read().replace(tmpdir, "/tmp")
+
+    with open(fixture, encoding="utf-8") as f:
+        assert written.replace(complete_version, "0.0.0") == f.read()
+
+
+def test_bagpath_resolver():
+    bagpaths = BagpathResolver([{"bagpath": "data/content/a.pdf"}])
+
+    assert bagpaths.resolve("data/content/b.pdf", 1) == "data/content/b.pdf"
+    assert bagpaths.resolve("data/content/a.pdf", 2) == "data/content/2-a.pdf"
+    assert bagpaths.resolve("data/content/a.pdf", 2) == "data/content/2-2-a.pdf"
+    assert bagpaths.resolve("data/content/sub/a.pdf", 3) == "data/content/sub/a.pdf"
+
+    # Thousands of attachments with the same name
+    resolved = {bagpaths.resolve("data/content/slides.pdf", i) for i in range(10000)}
+    assert len(resolved) == 10000
+    assert "data/content/9999-slides.pdf" in resolved
@@ -0,0 +1,38 @@
+import os
+import tempfile
+
+from .. import fileops
+
+
+def test_link_file():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = f"{tmpdir}/src"
+        with open(src, "wb") as f:
+            f.write(b"payload")
+        os.chmod(src, 0o640)
+
+        for mode in fileops.LINK_MODES:
+            dest = f"{tmpdir}/{mode}"
+            method = fileops.link_file(src, dest, mode)
+
+            assert open(dest, "rb").read() == b"payload"
+            assert os.stat(dest).st_mode & 0o777 == 0o640
+            # Only hardlinks share the file with the source
+            shared = os.path.samefile(src, dest)
+            assert shared == (method == "hardlink")
+            if mode != "hardlink":
+                assert not shared
+
+
+def test_link_tree():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(f"{tmpdir}/src/a/b")
+        for path in ["1.txt", "a/2.txt", "a/b/3.txt"]:
+            with open(f"{tmpdir}/src/{path}", "w") as f:
+                f.write(path)
+
+        methods = fileops.link_tree(f"{tmpdir}/src", f"{tmpdir}/dest", "hardlink")
+
+        assert sum(methods.values()) == 3
+        for path in ["1.txt", "a/2.txt", "a/b/3.txt"]:
+            assert open(f"{tmpdir}/dest/{path}").read() == path
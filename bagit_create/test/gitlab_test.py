@@ -0,0 +1,343 @@
+import hashlib
+import io
+import json
+import os
+import subprocess
+import tarfile
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from ..entries import FileEntry, FileOrigin
+from ..pipelines.gitlab import GitlabException, GitlabPipeline
+
+ENDPOINT = "https://gitlab.example.org/api/v4/projects/1/repository/tree"
+
+
+class FakeResponse:
+    ok = True
+
+    def __init__(self, page, total_pages=None):
+        self.url = f"{ENDPOINT}?page={page}"
+        self.page = page
+        self.headers = {}
+        self.links = {}
+        if total_pages:
+            self.headers["X-Total-Pages"] = str(total_pages)
+        elif page < 5:
+            self.links["next"] = {"url": f"{ENDPOINT}?page={page + 1}"}
+
+    def json(self):
+        return [{"path": f"{self.page}-{i}", "type": "blob"} for i in range(3)]
+
+
+class FakeSession:
+    def post(self, url):
+        # Export requested
+        return FakeResponse(1)
+
+
+def test_get_tree_pages():
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    requested = []
+
+    def make_api_request(endpoint, page, headers):
+        requested.append(page)
+        return FakeResponse(page, total_pages=5)
+
+    pipeline.make_api_request = make_api_request
+    response, files = pipeline.get_tree(ENDPOINT)
+
+    assert response.page == 1
+    assert sorted(requested) == [1, 2, 3, 4, 5]
+    # Every entry of every page, in order
+    assert [file["path"] for file in files] == [
+        f"{page}-{i}" for page in range(1, 6) for i in range(3)
+    ]
+
+
+def test_get_tree_links():
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+
+    def make_api_request(endpoint, page, headers):
+        # Without the totals, the next pages are requested by URL
+        if page is None:
+            page = int(endpoint.rsplit("=", 1)[1])
+        return FakeResponse(page)
+
+    pipeline.make_api_request = make_api_request
+    response, files = pipeline.get_tree(ENDPOINT)
+
+    assert len(files) == 15
+    assert files[-1]["path"] == "5-2"
+
+
+class FakeEvent:
+    """
+    Never set, records how long it was waited for
+    """
+
+    def __init__(self):
+        self.waits = []
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        return False
+
+    def is_set(self):
+        return False
+
+
+def test_export_backoff():
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    pipeline.export_cancelled = FakeEvent()
+
+    checks = []
+
+    def check_export(base_path):
+        checks.append(base_path)
+        if len(checks) < 7:
+            return False, None
+        return True, [
+            FileEntry(
+                origin=FileOrigin(filename="project.json"),
+                bagpath="data/content/repository_metadata/project.json",
+            )
+        ]
+
+    pipeline.check_export = check_export
+    pipeline.export = Future()
+    pipeline.wait_for_export("/bag", pipeline.export)
+
+    # Waits twice as long after every check, up to the maximum
+    assert pipeline.export_cancelled.waits == [1, 2, 4, 8, 16, 30, 30]
+
+    files = pipeline.join_export([])
+    assert files[0]["metadata"] is True
+    assert files[0]["origin"]["url"].endswith("/projects/1/export")
+    assert pipeline.export is None
+
+
+def test_export_timeout():
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    pipeline.total_seconds_allowed = 0
+    pipeline.export_cancelled = FakeEvent()
+    pipeline.check_export = lambda base_path: (False, None)
+
+    pipeline.export = Future()
+    pipeline.wait_for_export("/bag", pipeline.export)
+
+    # The error is raised when joining the export
+    with pytest.raises(GitlabException):
+        pipeline.join_export([])
+
+
+def test_export_cancel(tmp_path, monkeypatch):
+    monkeypatch.setattr(GitlabPipeline, "session", property(lambda self: FakeSession()))
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    pipeline.base_path = str(tmp_path)
+    checks = []
+
+    def check_export(base_path):
+        checks.append(base_path)
+        return False, None
+
+    pipeline.check_export = check_export
+    pipeline.interval_seconds = 0.01
+    pipeline.start_export()
+    export = pipeline.export
+    while not checks:
+        time.sleep(0.01)
+
+    # The job failed: the export stops right away, before its folder is deleted
+    pipeline.cancel_background_tasks()
+
+    assert pipeline.export_thread is None
+    assert isinstance(export.exception(timeout=0), GitlabException)
+    assert pipeline.join_export([]) == []
+
+
+def test_clone_modes(tmp_path):
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    git = ["git", "-C", str(repo), "-c", "user.name=a", "-c", "user.email=a@a"]
+    subprocess.run(["git", "init", "-q", str(repo)], check=True)
+    # Allow partial clones from the local repository
+    subprocess.run([*git, "config", "uploadpack.allowFilter", "true"], check=True)
+    for i in range(2):
+        (repo / "file.txt").write_text(f"version {i}")
+        (repo / "large.bin").write_bytes(bytes([i]) * 2 * 1024 * 1024)
+        subprocess.run([*git, "add", "file.txt", "large.bin"], check=True)
+        subprocess.run([*git, "commit", "-q", "-m", f"commit {i}"], check=True)
+
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    url = f"file://{repo}"
+
+    for mode in ["full", "shallow", "partial", "bundle"]:
+        pipeline.clone_mode = mode
+        bag = tmp_path / mode
+        destination = bag / "data/content/repository_files"
+        destination.mkdir(parents=True)
+        pipeline.clone_repository(url, str(destination), str(bag))
+
+        if mode == "bundle":
+            # A single file, and no leftovers of the mirror clone
+            assert os.listdir(destination) == ["repository.bundle"]
+            assert os.listdir(bag) == ["data"]
+            subprocess.run(
+                ["git", "bundle", "verify", str(destination / "repository.bundle")],
+                check=True,
+                capture_output=True,
+            )
+        else:
+            assert (destination / "file.txt").read_text() == "version 1"
+            commits = subprocess.run(
+                ["git", "-C", str(destination), "rev-list", "--count", "HEAD"],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            assert int(commits) == (1 if mode == "shallow" else 2)
+            missing = subprocess.run(
+                [
+                    "git",
+                    "-C",
+                    str(destination),
+                    "rev-list",
+                    "--objects",
+                    "--all",
+                    "--missing=print",
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            # Only the large blob of the first commit is left on the server
+            missing = [line for line in missing.splitlines() if line.startswith("?")]
+            assert len(missing) == (1 if mode == "partial" else 0)
+
+
+def test_bundle_files(tmp_path):
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    pipeline.clone_mode = "bundle"
+    pipeline.http_url_to_repo = "https://gitlab.example.org/group/repo.git"
+    pipeline.url_to_repo = "https://gitlab.example.org/group/repo"
+    (tmp_path / "data/content").mkdir(parents=True)
+
+    def clone_repository(url, destination, base_path):
+        with open(f"{destination}/repository.bundle", "wb") as f:
+            f.write(b"bundle")
+
+    pipeline.clone_repository = clone_repository
+    # As listed from the repository tree
+    files = [
+        FileEntry(
+            origin=FileOrigin(filename="main.py", path="src"),
+            bagpath="data/content/repository_files/src/main.py",
+            downloaded=False,
+            metadata=False,
+        ),
+        FileEntry(
+            origin=FileOrigin(filename="metadata.json", path=""),
+            bagpath="data/content/metadata.json",
+            downloaded=True,
+            metadata=True,
+        ),
+    ]
+
+    files = pipeline.download_files(files, str(tmp_path))
+
+    # The files of the tree are only in the bundle
+    assert [(file["bagpath"], file["downloaded"]) for file in files] == [
+        ("data/content/metadata.json", True),
+        ("data/content/repository_files/repository.bundle", True),
+    ]
+
+
+def test_extract_export(tmp_path):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        for name, data in [
+            ("./project.json", b"{}"),
+            ("./tree/issues.ndjson", b"issue\n" * 1000),
+            ("../outside.txt", b"no"),
+        ]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1600000000
+            tar.addfile(info, io.BytesIO(data))
+    archive.seek(0)
+
+    destination = tmp_path / "data/content/repository_metadata"
+    destination.mkdir(parents=True)
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    files = pipeline.extract_export(archive, str(destination))
+
+    assert not (tmp_path / "data/content/outside.txt").exists()
+    assert [file["bagpath"] for file in files] == [
+        "data/content/repository_metadata/project.json",
+        "data/content/repository_metadata/tree/issues.ndjson",
+    ]
+    issues = files[1]
+    assert issues["origin"]["path"] == "repository_metadata/tree"
+    assert issues["size"] == 6000
+    assert issues["checksum"] == [
+        "sha256:" + hashlib.sha256(b"issue\n" * 1000).hexdigest()
+    ]
+    assert (destination / "tree/issues.ndjson").read_bytes() == b"issue\n" * 1000
+    assert os.path.getmtime(destination / "project.json") == 1600000000
+
+
+def test_merge_files_large_tree():
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    n = 100000
+
+    def entry(path, **kwargs):
+        return FileEntry(
+            origin=FileOrigin(filename=path, path="", sourcePath=f"/tmp/{path}"),
+            bagpath=f"data/content/repository_files/{path}",
+            **kwargs,
+        )
+
+    # Every file of the tree, as listed from the API...
+    files = [entry(f"{i}.txt", downloaded=False, metadata=False) for i in range(n)]
+    # ...then found in the clone, plus the .git folder
+    cloned = [entry(f"{i}.txt") for i in reversed(range(n))]
+    cloned += [entry(f".git/objects/{i}", rawstat=None) for i in range(10)]
+
+    start = time.monotonic()
+    files = pipeline.merge_files(files, cloned, url="https://repo", metadata=False)
+    elapsed = time.monotonic() - start
+
+    assert len(files) == n + 10
+    assert all(file["downloaded"] for file in files)
+    assert "sourcePath" not in files[0]["origin"]
+    assert files[-1]["origin"]["url"] == "https://repo"
+    assert "rawstat" not in files[-1]
+    # Matching every cloned file with a scan of the list would take minutes
+    assert elapsed < 5
+
+
+def test_parse_metadata(tmp_path):
+    pipeline = GitlabPipeline("https://gitlab.example.org", 1, token="token")
+    pipeline.metadata_url = ENDPOINT
+    pipeline.metadata_size = 0
+    metadata = {
+        "project": {"id": 1},
+        "files": [
+            {"id": "a1", "name": "src", "type": "tree", "path": "src"},
+            {"id": "b2", "name": "main.py", "type": "blob", "path": "src/main.py"},
+        ],
+    }
+    metadata_path = tmp_path / pipeline.metadata_filename
+    metadata_path.write_text(json.dumps(metadata))
+
+    files, meta_file_entry = pipeline.parse_metadata(str(metadata_path))
+
+    assert [file["bagpath"] for file in files] == [
+        "data/content/repository_files/src/main.py",
+        f"data/content/{pipeline.metadata_filename}",
+    ]
+    assert files[0]["origin"]["id"] == "b2"
+    assert files[-1] is meta_file_entry
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import tempfile
+
+from .. import hashing
+from ..pipelines import base
+
+content = os.urandom(3 * 1024 * 1024 + 17)
+
+
+def test_hash_file():
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(content)
+        f.flush()
+
+        digests = hashing.hash_file(
+            f.name, ["md5", "sha1", "sha256", "adler32"], chunk_size=1024 * 1024
+        )
+
+        assert digests["md5"] == hashlib.md5(content).hexdigest()
+        assert digests["sha1"] == hashlib.sha1(content).hexdigest()
+        assert digests["sha256"] == hashlib.sha256(content).hexdigest()
+        assert digests["adler32"] == base.BasePipeline().adler32sum(f.name)
+
+
+def test_generate_manifests():
+    pipeline = base.BasePipeline()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(f"{tmpdir}/a.txt", "wb") as f:
+            f.write(b"a")
+        with open(f"{tmpdir}/b.txt", "wb") as f:
+            f.write(b"b")
+
+        files = [
+            # md5 is known from the metadata, only sha1 has to be computed
+            {"bagpath": "a.txt", "downloaded": True, "checksum": "md5:0"},
+            {"bagpath": "b.txt", "downloaded": True},
+            # Not downloaded and without checksums, won't be listed
+            {"bagpath": "c.txt", "downloaded": False},
+        ]
+
+        contents, files = pipeline.generate_manifests(files, ["md5", "sha1"], tmpdir)
+
+    sha1_a = hashlib.sha1(b"a").hexdigest()
+    md5_b = hashlib.md5(b"b").hexdigest()
+    sha1_b = hashlib.sha1(b"b").hexdigest()
+
+    assert contents["md5"] == f"0 a.txt\n{md5_b} b.txt\n"
+    assert contents["sha1"] == f"{sha1_a} a.txt\n{sha1_b} b.txt\n"
+    assert files[0]["checksum"] == ["md5:0", f"sha1:{sha1_a}"]
+    assert files[1]["checksum"] == [f"md5:{md5_b}", f"sha1:{sha1_b}"]
+    assert "checksum" not in files[2]
+
+
+def test_hash_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        jobs = []
+        expected = {}
+        # A mix of small (batched) and large files
+        for idx in range(50):
+            data = os.urandom(idx * 97 if idx % 10 else hashing.SMALL_FILE_SIZE + idx)
+            with open(f"{tmpdir}/{idx}", "wb") as f:
+                f.write(data)
+            jobs.append((idx, f"{tmpdir}/{idx}", ["md5", "adler32"], None))
+            expected[idx] = (hashlib.md5(data).hexdigest(), len(data))
+
+        results = hashing.hash_files(jobs, workers=4)
+
+    assert sorted(results) == list(range(50))
+    for idx, hasher in results.items():
+        assert (hasher.hexdigests()["md5"], hasher.size) == expected[idx]
+
+
+def test_create_manifests_streaming(monkeypatch):
+    # Process the files a few at a time
+    monkeypatch.setattr(base, "MANIFEST_WINDOW", 3)
+    pipeline = base.BasePipeline()
+    pipeline.algorithms = ["md5", "sha1"]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for idx in range(10):
+            with open(f"{tmpdir}/{idx}.txt", "w") as f:
+                f.write(str(idx))
+
+        def entries():
+            for idx in range(10):
+                yield {"bagpath": f"{idx}.txt", "downloaded": True}
+
+        contents, files = pipeline.generate_manifests(entries(), ["md5", "sha1"], tmpdir)
+        created = pipeline.create_manifests(entries(), tmpdir)
+
+        # The generators are consumed, every updated file is returned
+        for returned in [files, created]:
+            assert [file["bagpath"] for file in returned] == [
+                f"{idx}.txt" for idx in range(10)
+            ]
+            assert all(len(file["checksum"]) == 2 for file in returned)
+
+        for alg in ["md5", "sha1"]:
+            with open(f"{tmpdir}/manifest-{alg}.txt") as f:
+                assert f.read() == contents[alg]
+            assert contents[alg].splitlines()[9].endswith(" 9.txt")
@@ -0,0 +1,39 @@
+import time
+
+from .. import httpclient
+
+
+class FakeResponse:
+    def __init__(self, headers, status_code=200):
+        self.headers = headers
+        self.status_code = status_code
+
+
+def test_rate_limiter_pacing():
+    limiter = httpclient.RateLimiter("example.org")
+
+    # No rate limit announced yet, requests are not paced
+    start = time.monotonic()
+    for _ in range(20):
+        limiter.acquire()
+    assert time.monotonic() - start < 0.1
+
+    # 20 requests left in the next 2 seconds: after the burst, requests are
+    #  spread at (slightly less than) 10 per second
+    limiter.update(
+        FakeResponse({"X-RateLimit-Remaining": "20", "X-RateLimit-Reset": "2"})
+    )
+    start = time.monotonic()
+    for _ in range(httpclient.RATE_LIMIT_BURST + 3):
+        limiter.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.25 < elapsed < 1
+
+
+def test_rate_limiter_retry_after():
+    limiter = httpclient.RateLimiter("example.org")
+    limiter.update(FakeResponse({"Retry-After": "30"}, status_code=429))
+
+    # The host is blocked for the requested time (plus a margin)
+    assert limiter.blocked_until - time.monotonic() > 30
+    assert httpclient.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
@@ -0,0 +1,29 @@
+import json
+
+from ..pipelines import indico
+
+
+def test_attachment_named_as_metadata(tmp_path):
+    pipeline = indico.IndicoV1Pipeline("https://indico.example.org/")
+    pipeline.metadata_url = "https://indico.example.org/export/event/7.json"
+    pipeline.metadata_size = 0
+    url = "https://indico.example.org/event/7/attachments/1/2"
+    attachments = [
+        {"download_url": f"{url}/metadata-indico-7.json", "id": 2},
+        {"download_url": f"{url}/slides.pdf", "id": 3},
+    ]
+    metadata = {
+        "results": [{"folders": [{"attachments": attachments}], "contributions": []}]
+    }
+    metadata_path = tmp_path / "metadata-indico-7.json"
+    metadata_path.write_text(json.dumps(metadata))
+
+    files, meta_file_entry = pipeline.parse_metadata(str(metadata_path))
+
+    # The attachment doesn't take the bagpath of the metadata file
+    assert [file["bagpath"] for file in files] == [
+        "data/content/2-metadata-indico-7.json",
+        "data/content/slides.pdf",
+        "data/content/metadata-indico-7.json",
+    ]
+    assert files[-1] is meta_file_entry
@@ -0,0 +1,52 @@
+import io
+import json
+
+import pytest
+
+from .. import jsonstream
+
+DOCUMENT = {
+    "id": 42,
+    "metadata": {
+        "files": [
+            {"key": "a.root", "size": 1024, "checksum": "adler32:01"},
+            {"key": "b.json", "size": 2.5, "type": "index_json"},
+        ],
+        "title": "Ünïcode",
+    },
+    "results": [{"folders": [{"attachments": [1, 2]}, {"attachments": [3]}]}],
+}
+
+
+@pytest.fixture(params=["ijson", "json"])
+def parser(request, monkeypatch):
+    if request.param == "ijson":
+        pytest.importorskip("ijson")
+    else:
+        # Fallback when ijson is not installed
+        monkeypatch.setattr(jsonstream, "ijson", None)
+    return request.param
+
+
+def document():
+    return io.BytesIO(json.dumps(DOCUMENT, ensure_ascii=False).encode("utf-8"))
+
+
+def test_iter_items(parser):
+    files = list(jsonstream.iter_items(document(), "metadata.files.item"))
+    assert files == DOCUMENT["metadata"]["files"]
+    # Numbers are loaded as json would
+    assert type(files[0]["size"]) is int
+    assert type(files[1]["size"]) is float
+
+    attachments = jsonstream.iter_items(
+        document(), "results.item.folders.item.attachments.item"
+    )
+    assert list(attachments) == [1, 2, 3]
+    assert list(jsonstream.iter_items(document(), "missing.item")) == []
+
+
+def test_get_value(parser):
+    assert jsonstream.get_value(document(), "id") == 42
+    assert jsonstream.get_value(document(), "metadata.title") == "Ünïcode"
+    assert jsonstream.get_value(document(), "missing") is None
@@ -5,6 +5,7 @@ import pytest
 from oais_utils.validate import validate_sip
 
 from .. import main
+from ..pipelines import local
 
 
 def test_local_files():
@@ -49,3 +50,33 @@ def test_local_files():
                 f2.close()
 
     assert valid_structure == True
+
+
+def test_scan_files():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(f"{tmpdir}/src/a/b")
+        os.makedirs(f"{tmpdir}/src/empty")
+        for path in ["1.txt", "a/2.txt", "a/b/3.txt"]:
+            with open(f"{tmpdir}/src/{path}", "w") as f:
+                f.write(path)
+
+        pipeline = local.LocalV1Pipeline(f"{tmpdir}/src")
+        files = pipeline.scan_files(f"{tmpdir}/src", "python-test")
+
+        assert sorted(file["bagpath"] for file in files) == [
+            "data/content/1.txt",
+            "data/content/a/2.txt",
+            "data/content/a/b/3.txt",
+        ]
+        for file in files:
+            path = file["bagpath"][len("data/content/") :]
+            assert file["origin"]["sourcePath"] == f"{tmpdir}/src/{path}"
+            assert file["size"] == len(path)
+            assert file["rawstat"]["st_size"] == len(path)
+
+        # Files are copied from the scanned entries
+        os.makedirs(f"{tmpdir}/bag/data/content")
+        pipeline.copy_files(files, f"{tmpdir}/src", f"{tmpdir}/bag/data/content")
+        assert open(f"{tmpdir}/bag/data/content/a/b/3.txt").read() == "a/b/3.txt"
+        # Along with the empty folders
+        assert os.path.isdir(f"{tmpdir}/bag/data/content/empty")
@@ -1,9 +1,12 @@
+import hashlib
 import ntpath
 import os
 import shutil
 import tempfile
 from os import walk
 
+import bagit
+
 from ..pipelines import base, invenio_v1
 
 pipeline = invenio_v1.InvenioV1Pipeline("https://some/invenio/v1/instance", recid=1)
@@ -95,3 +98,255 @@ def test_target_option():
 
     assert file_1_exists == True
     assert file_2_exists == True
+
+
+def test_run_downloads():
+    pipeline = base.BasePipeline()
+    pipeline.download_workers = 3
+
+    files = [{"downloaded": False} for _ in range(10)]
+    # Odd files "fail" to download
+    tasks = [
+        (idx, f"/dest/{idx}", lambda dest, hasher, idx=idx: idx % 2 == 0)
+        for idx in range(10)
+    ]
+
+    files = pipeline.run_downloads(files, tasks)
+
+    assert [file["downloaded"] for file in files] == [idx % 2 == 0 for idx in range(10)]
+
+
+def test_run_downloads_error():
+    pipeline = base.BasePipeline()
+
+    def broken_fetch(dest, hasher):
+        raise IOError("Connection reset")
+
+    files = [{"downloaded": False}]
+
+    try:
+        pipeline.run_downloads(files, [(0, "/dest/0", broken_fetch)])
+        raised = False
+    except IOError:
+        raised = True
+
+    assert raised is True
+    assert files[0]["downloaded"] is False
+
+
+def test_run_downloads_checksums():
+    pipeline = base.BasePipeline()
+    pipeline.algorithms = ["md5", "sha1"]
+
+    def fetch(dest, hasher):
+        hasher.update(b"payload")
+        return True
+
+    md5 = hashlib.md5(b"payload").hexdigest()
+    sha1 = hashlib.sha1(b"payload").hexdigest()
+
+    # The upstream md5 is verified and kept, sha1 is added from the stream
+    files = [{"downloaded": False, "checksum": f"md5:{md5}"}]
+    files = pipeline.run_downloads(files, [(0, "/dest/0", fetch)])
+    assert files[0]["checksum"] == [f"md5:{md5}", f"sha1:{sha1}"]
+
+    # A wrong upstream checksum makes the download fail
+    files = [{"downloaded": False, "checksum": "md5:0123456789abcdef"}]
+    try:
+        pipeline.run_downloads(files, [(0, "/dest/0", fetch)])
+        raised = False
+    except base.ChecksumMismatchException:
+        raised = True
+    assert raised is True
+
+
+def test_verify_bag_fast():
+    pipeline = base.BasePipeline()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(f"{tmpdir}/file.txt", "w") as f:
+            f.write("payload")
+        bagit.make_bag(tmpdir, checksums=["md5"])
+
+        md5 = hashlib.md5(b"payload").hexdigest()
+        files = [{"bagpath": "data/file.txt", "checksum": [f"md5:{md5}"]}]
+        assert pipeline.verify_bag(tmpdir, files) is True
+
+        files = [{"bagpath": "data/file.txt", "checksum": ["md5:0"]}]
+        assert pipeline.verify_bag(tmpdir, files) is False
+        # A full validation only looks at the payload on disk
+        assert pipeline.verify_bag(tmpdir, files, full_validate=True) is True
+
+
+def test_pipeline_session():
+    pipeline_a = base.BasePipeline()
+    pipeline_a.headers = {"Authorization": "Bearer a"}
+    pipeline_a.cookies = {"INVENIOSESSION": "a"}
+    pipeline_b = base.BasePipeline()
+    pipeline_b.headers = {"Authorization": "Bearer b"}
+
+    # The same settings share the same pooled session (and connections)
+    assert pipeline_a.session is pipeline_a.session
+    assert pipeline_a.session is not pipeline_b.session
+    assert pipeline_b.session.headers["Authorization"] == "Bearer b"
+    assert pipeline_a.session.cookies["INVENIOSESSION"] == "a"
+
+    # Cookies and headers set during a job are dropped when it ends, while
+    #  the next job of the process reuses the session
+    session = pipeline_a.session
+    session.cookies.set("sessionid", "a")
+    session.headers["X-Job"] = "a"
+    pipeline_a.close_session()
+
+    pipeline_c = base.BasePipeline()
+    pipeline_c.headers = {"Authorization": "Bearer a"}
+    assert pipeline_c.session is session
+    assert not session.cookies
+    assert "X-Job" not in session.headers
+    assert session.headers["Authorization"] == "Bearer a"
+
+
+def test_shared_staging_folder():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pipeline_a = base.BasePipeline()
+        pipeline_b = base.BasePipeline()
+        staging_path = pipeline_a.get_staging_path(tmpdir)
+        assert pipeline_b.get_staging_path(tmpdir) == staging_path
+
+        # Another job finished and removed the (empty) staging folder
+        pipeline_a.remove_staging_folder(staging_path)
+        assert not os.path.exists(staging_path)
+
+        base_path, _ = pipeline_b.prepare_folders(
+            "test", 1, 100, staging_path=staging_path
+        )
+        assert os.path.isdir(f"{base_path}/data/content")
+
+
+def test_resume_downloads():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pipeline = base.BasePipeline()
+        base_path, _ = pipeline.prepare_folders(
+            "test", 1, 100, staging_path=tmpdir, resume=True
+        )
+
+        fetched = []
+
+        def fetch(dest, hasher):
+            fetched.append(dest)
+            with open(dest, "wb") as f:
+                f.write(b"payload")
+            hasher.update(b"payload")
+            return True
+
+        destinations = [f"{base_path}/data/content/{idx}.txt" for idx in range(2)]
+        files = [{"downloaded": False} for _ in destinations]
+        tasks = [(idx, dest, fetch) for idx, dest in enumerate(destinations)]
+        pipeline.run_downloads(files, tasks)
+
+        # A second run reuses the folder and doesn't download the files again,
+        #  but tag files and anything not in the journal is removed
+        open(f"{base_path}/bagit.txt", "w").close()
+        open(f"{base_path}/data/content/metadata.json", "w").close()
+
+        pipeline = base.BasePipeline()
+        new_base_path, _ = pipeline.prepare_folders(
+            "test", 1, 200, staging_path=tmpdir, resume=True
+        )
+        assert new_base_path != base_path
+        assert not os.path.exists(base_path)
+        assert sorted(os.listdir(f"{new_base_path}/data/content")) == [
+            "0.txt",
+            "1.txt",
+        ]
+        assert not os.path.exists(f"{new_base_path}/bagit.txt")
+
+        fetched.clear()
+        destinations = [f"{new_base_path}/data/content/{idx}.txt" for idx in range(2)]
+        files = [{"downloaded": False} for _ in destinations]
+        tasks = [(idx, dest, fetch) for idx, dest in enumerate(destinations)]
+        files = pipeline.run_downloads(files, tasks)
+
+        md5 = hashlib.md5(b"payload").hexdigest()
+        assert fetched == []
+        assert [file["checksum"] for file in files] == [[f"md5:{md5}"]] * 2
+
+
+class FakeRangeResponse:
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+
+class FakeSession:
+    def __init__(self, get):
+        self.get = get
+
+
+def test_resume_other_range(monkeypatch):
+    requests = []
+
+    def get(url, stream, headers):
+        requests.append(headers)
+        if "Range" in headers:
+            # Not the requested range
+            return FakeRangeResponse(206, b"lo", {"Content-Range": "bytes 3-4/5"})
+        return FakeRangeResponse(200, b"hello", {"Accept-Ranges": "bytes"})
+
+    monkeypatch.setattr(
+        base.BasePipeline, "session", property(lambda self: FakeSession(get))
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pipeline = base.BasePipeline()
+        base_path, _ = pipeline.prepare_folders(
+            "test", 1, 100, staging_path=tmpdir, resume=True
+        )
+        dest = f"{base_path}/data/content/file.txt"
+        with open(dest, "wb") as f:
+            f.write(b"he")
+        pipeline.journal.record(pipeline.journal_key(dest), "partial", validator="v")
+
+        hasher = hashlib.md5()
+        pipeline.download_file("https://example.org/file.txt", dest, {}, hasher)
+
+        # The partial file is dropped and downloaded again, without Range
+        assert [headers.get("Range") for headers in requests] == ["bytes=2-", None]
+        with open(dest, "rb") as f:
+            assert f.read() == b"hello"
+        assert hasher.hexdigest() == hashlib.md5(b"hello").hexdigest()
+
+
+def test_payload_oxum():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pipeline = base.BasePipeline()
+        base_path, _ = pipeline.prepare_folders("test", 1, 100, staging_path=tmpdir)
+
+        files = []
+        for idx in range(3):
+            with open(f"{base_path}/data/content/{idx}.txt", "wb") as f:
+                f.write(b"x" * idx)
+            files.append({"bagpath": f"data/content/{idx}.txt", "downloaded": True})
+        pipeline.create_manifests(files, base_path)
+
+        # Sizes collected while hashing give the same result of a scan
+        pipeline.add_bag_info(
+            base_path, f"{tmpdir}/collected.txt", pipeline.payload_sizes
+        )
+        pipeline.add_bag_info(base_path, f"{tmpdir}/scanned.txt")
+
+        collected = open(f"{tmpdir}/collected.txt").read()
+        assert "Payload-Oxum: 3.3\n" in collected
+        assert collected == open(f"{tmpdir}/scanned.txt").read()
@@ -6,39 +6,39 @@ To learn more about this: https://gitlab.cern.ch/digitalmemory/bagit-create#codi
 """
 
 import os
-import time
 
 import requests
 
 import bagit_create
 
-session_id = os.environ["CODIMD_SESSION"]
-max_attempts = 5
-
-r = requests.get(
-    "https://codimd.web.cern.ch/history",
-    stream=True,
-    cookies={"connect.sid": session_id},
-)
-
-data = r.json()["history"][2:]
-
-print(f"Found {len(data)} notes in your history..")
-
-for note in data:
-    attempts = 0
-    while True:
-        attempts += 1
-        print(f"Creating SIP for {note['text']} ({note['id']})..")
-        result = bagit_create.main.process(
-            source="codimd", recid=note["id"], token=session_id, loglevel=3
-        )
-        if result["status"] == 0:
-            break
-        else:
-            print("Waiting to try again..")
-            time.sleep(5)
-        if attempts == max_attempts:
-            print("Giving up..")
-            break
-        print(result)
+# Jobs run in worker processes, so the script must be import-safe
+if __name__ == "__main__":
+    session_id = os.environ["CODIMD_SESSION"]
+    max_attempts = 5
+
+    r = requests.get(
+        "https://codimd.web.cern.ch/history",
+        stream=True,
+        cookies={"connect.sid": session_id},
+    )
+
+    data = r.json()["history"][2:]
+
+    print(f"Found {len(data)} notes in your history..")
+
+    print(f"Creating SIPs for {[note['text'] for note in data]}..")
+
+    report = bagit_create.batch.process_many(
+        [("codimd", note["id"]) for note in data],
+        workers=4,
+        retries=max_attempts - 1,
+        retry_delay=5,
+        token=session_id,
+        loglevel=3,
+    )
+
+    for result in report["results"]:
+        if result["status"] != 0:
+            print(f"Giving up on {result['recid']}: {result['errormsg']}")
+
+    print(report["summary"])
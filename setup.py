@@ -60,9 +60,14 @@ setup(
         "python-cern-sso==1.3.3",
         "python-slugify==6.1.2",
     ],
+    extras_require={
+        # Parse large metadata documents incrementally
+        "streaming": ["ijson>=3.1"],
+    },
     entry_points={
         "console_scripts": [
             "bic=bagit_create.cli:cli",
+            "bic-batch=bagit_create.cli:batch",
         ]
     },
 )